@@ -1,8 +1,32 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, make_response, request
 from flask_cors import CORS
 import sqlite3
 import os
 from datetime import datetime
+import base64
+import binascii
+import csv
+import functools
+import gzip
+import io
+import json
+import math
+import time
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from catalog_engine import CatalogEngine
+from db_pool import ConnectionPool
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Metrics
+from product_queries import (DEFAULT_SELECT, DISTRIBUTION_CENTER_JOIN, build_product_filter, count_query,
+                            export_query, facet_counts, facet_query, group_query, keyset_query, page_query,
+                            parse_facets)
+from response_cache import GenerationCache, ResponseCache
+from serialization import JSON_ENCODER, column_names, dumps, json_response, row_as_dict, rows_as_dicts
+from slow_query_log import SlowQueryLog
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
@@ -10,25 +34,341 @@ CORS(app)  # Enable CORS for all routes
 # Database configuration
 DATABASE = 'ecommerce.db'
 
+# Generation of the database file last seen on disk. The loader publishes
+# new data by renaming a freshly built file over DATABASE, so a different
+# inode/mtime means a new generation. The (signature, value) pair is
+# replaced in one assignment so no request sees a new signature with the
+# previous generation's value.
+_generation = {'current': (None, None)}
+
+def get_data_generation():
+    """Return the generation id of the database currently on disk"""
+    try:
+        stat = os.stat(DATABASE)
+    except FileNotFoundError:
+        return None
+    signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    current_signature, value = _generation['current']
+    if signature != current_signature:
+        value = str(stat.st_mtime_ns)
+        try:
+            conn = sqlite3.connect(f'file:{DATABASE}?mode=ro', uri=True)
+            try:
+                row = conn.execute("SELECT value FROM load_metadata WHERE key = 'generation'").fetchone()
+            finally:
+                conn.close()
+            if row:
+                value = row[0]
+        except sqlite3.Error:
+            # Databases built before generations were recorded
+            pass
+        _generation['current'] = (signature, value)
+    return value
+
+# Idle read-only connections kept between requests
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+
+db_pool = ConnectionPool(DATABASE, get_data_generation, POOL_SIZE)
+
 def get_db_connection():
-    """Create a database connection"""
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row  # This enables column access by name
-    return conn
+    """Return this request's pooled connection to the current database generation"""
+    if 'db' not in g:
+        g.db, g.db_generation = db_pool.acquire()
+    return g.db
+
+@app.teardown_appcontext
+def release_db_connection(exception):
+    """Return the request's connection to the pool"""
+    conn = g.pop('db', None)
+    if conn is not None:
+        db_pool.release(conn, g.pop('db_generation'))
+
+# In-memory copy of the product catalog that answers listings without
+# search; off unless CATALOG_ENGINE is set. It is loaded in the background
+# at startup and whenever the generation changes (checked every
+# CATALOG_POLL_SECONDS)
+CATALOG_POLL_SECONDS = float(os.environ.get('CATALOG_POLL_SECONDS', 1))
+
+catalog_engine = None
+if os.environ.get('CATALOG_ENGINE', '').lower() in ('1', 'true', 'yes'):
+    catalog_engine = CatalogEngine(DATABASE, get_data_generation)
+    catalog_engine.start(CATALOG_POLL_SECONDS)
+
+# Request and SQL statistics served at /api/metrics
+metrics = Metrics()
+
+# Statements slower than SLOW_QUERY_MS are logged with their query plan to
+# SLOW_QUERY_LOG; the log is off unless SLOW_QUERY_MS is set
+slow_query_log = None
+if os.environ.get('SLOW_QUERY_MS'):
+    slow_query_log = SlowQueryLog(
+        os.environ.get('SLOW_QUERY_LOG', 'slow_queries.log'),
+        float(os.environ['SLOW_QUERY_MS']) / 1000,
+        max_bytes=int(os.environ.get('SLOW_QUERY_LOG_BYTES', 10 * 1024 * 1024)),
+        backup_count=int(os.environ.get('SLOW_QUERY_LOG_BACKUPS', 5)),
+    )
+
+def run_query(conn, name, query, params=()):
+    """Execute a query and fetch all its rows, recording the time and row count under name
+
+    Returns (cursor, rows).
+    """
+    trace = slow_query_log.start(conn) if slow_query_log else None
+    start = time.perf_counter()
+    rows = []
+    try:
+        cursor = conn.execute(query, params)
+        rows = cursor.fetchall()
+    finally:
+        seconds = time.perf_counter() - start
+        if trace is not None:
+            slow_query_log.finish(conn, trace, name, query, params, seconds, len(rows))
+    metrics.observe_query(name, seconds, len(rows))
+    return cursor, rows
+
+# Tables and product columns of the current database, read once per data
+# generation to find the optional tables the loader builds (search index,
+# summary tables) and the fields clients may select
+_schema = {'generation': None, 'tables': frozenset(), 'product_columns': ()}
+
+def get_schema(conn):
+    """Return the schema summary of the current database"""
+    global _schema
+    generation = g.get('db_generation')
+    if generation != _schema['generation'] or generation is None:
+        rows = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+        _schema = {
+            'generation': generation,
+            'tables': frozenset(row[0] for row in rows),
+            'product_columns': tuple(row[1] for row in conn.execute("PRAGMA table_info(products)")),
+        }
+    return _schema
+
+def has_table(conn, name):
+    """Return True if the current database has the given table"""
+    return name in get_schema(conn)['tables']
+
+def is_compact(conn):
+    """Return True if the current database has the compact layout (products is a view over product_rows)"""
+    return has_table(conn, 'product_rows')
+
+def product_select(conn, fields):
+    """Return (select_list, join_clause) for a fields= parameter
+
+    Without fields every product column and the distribution center name
+    are selected. The id is always included, since cursors and batch
+    lookups rely on it, and the distribution center join is only made when
+    its name is asked for. Raises ValueError for unknown fields.
+    """
+    if not fields:
+        return DEFAULT_SELECT, DISTRIBUTION_CENTER_JOIN
+    requested = [field.strip() for field in fields.split(',') if field.strip()]
+    columns = get_schema(conn)['product_columns']
+    unknown = [field for field in requested
+               if field not in columns and field != 'distribution_center_name']
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+
+    selected = list(dict.fromkeys(['id'] + requested))
+    select_list = ', '.join('dc.name as distribution_center_name' if field == 'distribution_center_name'
+                            else f'p.{field}' for field in selected)
+    join_clause = DISTRIBUTION_CENTER_JOIN if 'distribution_center_name' in selected else ''
+    return select_list, join_clause
+
+def encode_cursor(last_id):
+    """Encode the id of the last product on a page as an opaque cursor"""
+    token = json.dumps({'after_id': last_id}, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(token).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Decode a cursor from encode_cursor, raising ValueError if it is invalid"""
+    try:
+        token = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        after_id = json.loads(token)['after_id']
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise ValueError('Invalid cursor')
+    # bool is a subclass of int, but true is not an id
+    if not isinstance(after_id, int) or isinstance(after_id, bool) or after_id < 0:
+        raise ValueError('Invalid cursor')
+    return after_id
+
+def parse_after_id(value):
+    """Parse an after_id parameter, raising ValueError unless it is a non-negative integer"""
+    if value is None:
+        return None
+    try:
+        after_id = int(value)
+    except ValueError:
+        after_id = -1
+    if after_id < 0:
+        raise ValueError('after_id must be a non-negative integer')
+    return after_id
+
+# Serialized responses of the catalog metadata endpoints, which only
+# change when the loader publishes a new generation
+response_cache = ResponseCache(
+    max_entries=int(os.environ.get('RESPONSE_CACHE_ENTRIES', 128)),
+    max_bytes=int(os.environ.get('RESPONSE_CACHE_BYTES', 16 * 1024 * 1024)),
+)
+
+# Responses smaller than this are sent uncompressed
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', 1024))
+
+# Rows fetched from SQLite per chunk of a streaming export
+EXPORT_FETCH_SIZE = 1000
 
-def dict_from_row(row):
-    """Convert sqlite3.Row object to dictionary"""
-    return dict(zip(row.keys(), row))
+# Most ids accepted by one batch lookup
+MAX_BATCH_IDS = 500
+
+# Product listing totals keyed by filter signature, so paging through one
+# result set counts it once per data generation
+count_cache = GenerationCache(max_entries=int(os.environ.get('COUNT_CACHE_ENTRIES', 1024)))
+
+def count_products(conn, from_clause, where_clause, params):
+    """Return the number of products matching a filter, cached per generation"""
+    key = (from_clause, where_clause, tuple(params))
+    generation = g.get('db_generation')
+    total_count = count_cache.get(key, generation)
+    if total_count is None:
+        _, rows = run_query(conn, 'products.count', count_query(from_clause, where_clause), params)
+        total_count = rows[0][0]
+        count_cache.put(key, generation, total_count)
+    return total_count
+
+def count_facets(conn, from_clause, where_clause, params, facets):
+    """Return the facet counts of the products matching a filter, cached per generation"""
+    key = ('facets', from_clause, where_clause, tuple(params), facets)
+    generation = g.get('db_generation')
+    counts = count_cache.get(key, generation)
+    if counts is None:
+        query = facet_query(from_clause, where_clause, facets, is_compact(conn))
+        _, rows = run_query(conn, 'products.facets', query, params)
+        counts = count_cache.put(key, generation, facet_counts(rows, facets))
+    return counts
+
+def cached_response(view):
+    """Serve a GET endpoint from response_cache, answering If-None-Match with 304"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        generation = get_data_generation()
+        key = (request.path, request.query_string)
+        entry = response_cache.get(key, generation)
+        if entry is None:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            entry = response_cache.put(key, generation, response.get_data(), response.mimetype)
+
+        # Weak comparison: a compressed copy of the body carries a weak ETag
+        if request.if_none_match.contains_weak(entry.etag):
+            response = Response(status=304)
+        else:
+            response = Response(entry.body, mimetype=entry.mimetype)
+        response.set_etag(entry.etag)
+        # Clients may keep the body but must revalidate it with the ETag
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return wrapper
+
+@app.before_request
+def start_request_timer():
+    """Note when the request started, for the latency metrics"""
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """Record the request's latency, status and response size
+
+    after_request hooks run in reverse order of registration, so this one
+    sees the response after compress_response.
+    """
+    start = g.get('request_start')
+    if start is not None:
+        # Unmatched paths share one label to keep the number of series bounded
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe_request(route, request.method, response.status_code,
+                                time.perf_counter() - start, response.content_length or 0)
+    return response
+
+@app.after_request
+def compress_response(response):
+    """Compress a large response with brotli or gzip if the client accepts it"""
+    if (response.status_code != 200 or response.is_streamed or response.direct_passthrough
+            or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    if response.content_length is None or response.content_length < COMPRESSION_MIN_BYTES:
+        return response
+
+    encodings = ['br', 'gzip'] if brotli else ['gzip']
+    encoding = request.accept_encodings.best_match(encodings)
+    if encoding is None:
+        return response
+    data = response.get_data()
+    if encoding == 'br':
+        response.set_data(brotli.compress(data, quality=5))
+    else:
+        response.set_data(gzip.compress(data, compresslevel=6))
+    response.headers['Content-Encoding'] = encoding
+    # The encoded bytes differ from the ones the strong ETag was made for
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({
+    return json_response({
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
-        'database': 'connected' if os.path.exists(DATABASE) else 'not found'
+        'database': 'connected' if os.path.exists(DATABASE) else 'not found',
+        'generation': get_data_generation(),
+        'connection_pool': db_pool.stats(),
+        'response_cache': response_cache.stats(),
+        'count_cache': count_cache.stats(),
+        'slow_query_log': slow_query_log.stats() if slow_query_log else None,
+        'catalog_engine': catalog_engine.stats() if catalog_engine else None,
+        'json_encoder': JSON_ENCODER
     }), 200
 
+def get_product_filters():
+    """Read the product filter parameters shared by the listing and export endpoints
+
+    Raises ValueError for a price bound that is not a finite number; NaN
+    would match nothing in SQL and everything in the catalog engine.
+    """
+    filters = {
+        'category': request.args.get('category'),
+        'brand': request.args.get('brand'),
+        'department': request.args.get('department'),
+        'min_price': request.args.get('min_price', type=float),
+        'max_price': request.args.get('max_price', type=float),
+        'search': request.args.get('search'),
+    }
+    for name in ('min_price', 'max_price'):
+        if filters[name] is not None and not math.isfinite(filters[name]):
+            raise ValueError(f"{name} must be a finite number")
+    return filters
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Request, SQL, connection pool and cache metrics in the Prometheus text format"""
+    pool = db_pool.stats()
+    caches = {'response': response_cache.stats(), 'count': count_cache.stats()}
+    gauges = [
+        ('api_db_pool_connections', 'Pooled database connections by state.', 'gauge',
+         [({'state': 'idle'}, pool['idle']), ({'state': 'in_use'}, pool['in_use'])]),
+        ('api_db_pool_events_total', 'Connection pool events since startup.', 'counter',
+         [({'event': event}, pool[event]) for event in ('opened', 'reused', 'recycled', 'closed')]),
+        ('api_cache_entries', 'Entries held by each in-process cache.', 'gauge',
+         [({'cache': name}, stats['entries']) for name, stats in caches.items()]),
+        ('api_cache_events_total', 'Cache lookups and evictions since startup.', 'counter',
+         [({'cache': name, 'event': event}, stats[event])
+          for name, stats in caches.items() for event in ('hits', 'misses', 'evictions', 'invalidations')]),
+    ]
+    return Response(metrics.render(gauges), mimetype=None, content_type=METRICS_CONTENT_TYPE)
+
 @app.route('/api/products', methods=['GET'])
 def get_products():
     """Get all products with pagination and filtering"""
@@ -36,102 +376,223 @@ def get_products():
         # Get query parameters
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 20, type=int)
-        category = request.args.get('category')
-        brand = request.args.get('brand')
-        department = request.args.get('department')
-        min_price = request.args.get('min_price', type=float)
-        max_price = request.args.get('max_price', type=float)
-        search = request.args.get('search')
+        cursor_param = request.args.get('cursor')
+        sort = request.args.get('sort', 'id')
+        include_total = request.args.get('include_total', 'true').lower() not in ('false', '0', 'no')
+        try:
+            after_id = parse_after_id(request.args.get('after_id'))
+            filters = get_product_filters()
+            facets = parse_facets(request.args.get('facets', ''))
+        except ValueError as e:
+            return json_response({
+                'error': 'Bad request',
+                'message': str(e)
+            }), 400
         
         # Validate pagination parameters
         if page < 1:
             page = 1
         if per_page < 1 or per_page > 100:
             per_page = 20
+
+        # Keyset pagination: seek past the last id seen instead of skipping
+        # OFFSET rows, so every page costs the same however deep it is
+        if cursor_param:
+            try:
+                after_id = decode_cursor(cursor_param)
+            except ValueError as e:
+                return json_response({
+                    'error': 'Bad request',
+                    'message': str(e)
+                }), 400
+        keyset = after_id is not None
+
+        if sort not in ('id', 'relevance'):
+            return json_response({
+                'error': 'Bad request',
+                'message': "sort must be 'id' or 'relevance'"
+            }), 400
+        if keyset and sort == 'relevance':
+            return json_response({
+                'error': 'Bad request',
+                'message': 'Cursor pagination is ordered by id and cannot be combined with sort=relevance'
+            }), 400
             
         offset = (page - 1) * per_page
         
-        conn = get_db_connection()
-        
-        # Build the WHERE clause based on filters
-        where_conditions = []
-        params = []
-        
-        if category:
-            where_conditions.append("category = ?")
-            params.append(category)
-            
-        if brand:
-            where_conditions.append("brand = ?")
-            params.append(brand)
-            
-        if department:
-            where_conditions.append("department = ?")
-            params.append(department)
-            
-        if min_price is not None:
-            where_conditions.append("retail_price >= ?")
-            params.append(min_price)
-            
-        if max_price is not None:
-            where_conditions.append("retail_price <= ?")
-            params.append(max_price)
+        # Text search needs the FTS index, so only other filters are
+        # answered from the in-memory catalog
+        catalog = catalog_engine.get() if catalog_engine and not filters['search'] else None
+        if catalog is not None:
+            try:
+                columns = catalog.select_columns(request.args.get('fields'))
+            except ValueError as e:
+                return json_response({
+                    'error': 'Bad request',
+                    'message': str(e)
+                }), 400
+            matches = catalog.match(filters)
+            facet_results = catalog.facets(filters, facets) if facets else None
+            order_clause = 'p.id'
+        else:
+            conn = get_db_connection()
+            try:
+                select_list, join_clause = product_select(conn, request.args.get('fields'))
+            except ValueError as e:
+                return json_response({
+                    'error': 'Bad request',
+                    'message': str(e)
+                }), 400
+
+            has_search_index = has_table(conn, 'products_fts')
+            from_clause, where_clause, params, order_clause = build_product_filter(filters, sort, has_search_index)
+            # Totals and facets of a compact database are counted on product_rows
+            if is_compact(conn):
+                count_filter = build_product_filter(filters, has_search_index=has_search_index, compact=True)[:3]
+            else:
+                count_filter = (from_clause, where_clause, list(params))
+            facet_results = count_facets(conn, *count_filter, facets) if facets else None
+        
+        if keyset:
+            # Fetch one extra row to know whether there is a next page
+            if catalog is not None:
+                products = catalog.page_after(matches, after_id, per_page + 1, columns)
+            else:
+                query = keyset_query(select_list, from_clause, join_clause, where_clause)
+                cursor, rows = run_query(conn, 'products.list', query, params + [after_id, per_page + 1])
+                products = rows_as_dicts(cursor, rows)
+            has_next = len(products) > per_page
+            del products[per_page:]
+            last_id = products[-1]['id'] if products else None
+
+            pagination = {
+                'per_page': per_page,
+                'after_id': after_id,
+                'has_next': has_next,
+                'next_after_id': last_id if has_next else None,
+                'next_cursor': encode_cursor(last_id) if has_next else None
+            }
+        else:
+            limit = per_page if include_total else per_page + 1
+            if catalog is not None:
+                total_count = len(matches)
+                products = catalog.page(matches, offset, limit, columns)
+            else:
+                # Get total count for pagination, unless the client only needs
+                # has_next (then one extra row is fetched instead)
+                total_count = count_products(conn, *count_filter) if include_total else None
+
+                # Get products with pagination
+                query = page_query(select_list, from_clause, join_clause, where_clause, order_clause)
+                params.extend([limit, offset])
+
+                cursor, rows = run_query(conn, 'products.list', query, params)
+                products = rows_as_dicts(cursor, rows)
             
-        if search:
-            where_conditions.append("(name LIKE ? OR brand LIKE ? OR category LIKE ?)")
-            search_term = f"%{search}%"
-            params.extend([search_term, search_term, search_term])
-        
-        where_clause = " AND ".join(where_conditions) if where_conditions else "1=1"
-        
-        # Get total count for pagination
-        count_query = f"SELECT COUNT(*) as total FROM products WHERE {where_clause}"
-        cursor = conn.execute(count_query, params)
-        total_count = cursor.fetchone()['total']
-        
-        # Get products with pagination
-        query = f"""
-            SELECT p.*, dc.name as distribution_center_name
-            FROM products p
-            LEFT JOIN distribution_centers dc ON p.distribution_center_id = dc.id
-            WHERE {where_clause}
-            ORDER BY p.id
-            LIMIT ? OFFSET ?
-        """
-        params.extend([per_page, offset])
-        
-        cursor = conn.execute(query, params)
-        products = [dict_from_row(row) for row in cursor.fetchall()]
-        
-        # Calculate pagination info
-        total_pages = (total_count + per_page - 1) // per_page
-        has_next = page < total_pages
-        has_prev = page > 1
-        
-        conn.close()
-        
-        return jsonify({
-            'products': products,
-            'pagination': {
+            # Calculate pagination info
+            if include_total:
+                total_pages = (total_count + per_page - 1) // per_page
+                has_next = page < total_pages
+            else:
+                has_next = len(products) > per_page
+                del products[per_page:]
+            has_prev = page > 1
+
+            pagination = {
                 'page': page,
                 'per_page': per_page,
-                'total_count': total_count,
-                'total_pages': total_pages,
                 'has_next': has_next,
-                'has_prev': has_prev
-            },
-            'filters': {
-                'category': category,
-                'brand': brand,
-                'department': department,
-                'min_price': min_price,
-                'max_price': max_price,
-                'search': search
+                'has_prev': has_prev,
+                # Lets a client continue from this page in cursor mode
+                'next_cursor': (encode_cursor(products[-1]['id'])
+                                if has_next and products and order_clause == 'p.id' else None)
             }
-        }), 200
+            if include_total:
+                pagination['total_count'] = total_count
+                pagination['total_pages'] = total_pages
+        
+        payload = {
+            'products': products,
+            'pagination': pagination,
+            'filters': dict(filters, sort=sort, fields=request.args.get('fields'),
+                            facets=request.args.get('facets'))
+        }
+        if facet_results is not None:
+            payload['facets'] = facet_results
+        return json_response(payload), 200
         
     except Exception as e:
-        return jsonify({
+        return json_response({
+            'error': 'Internal server error',
+            'message': str(e)
+        }), 500
+
+def stream_export(query, params, export_format):
+    """Yield an export of a product query as NDJSON lines or CSV text
+
+    Rows are read from SQLite in chunks on a connection held only while
+    the response streams, so memory use does not grow with the result.
+    """
+    conn, generation = db_pool.acquire()
+    start = time.perf_counter()
+    exported = 0
+    try:
+        cursor = conn.execute(query, params)
+        if export_format == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer, lineterminator='\n')
+            writer.writerow(column_names(cursor))
+            while True:
+                rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+                exported += len(rows)
+                writer.writerows(rows)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+                if not rows:
+                    break
+        else:
+            while True:
+                rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+                if not rows:
+                    break
+                exported += len(rows)
+                yield b'\n'.join(dumps(product) for product in rows_as_dicts(cursor, rows)) + b'\n'
+    finally:
+        # Includes the time the client took to read the stream
+        metrics.observe_query('products.export', time.perf_counter() - start, exported)
+        db_pool.release(conn, generation)
+
+@app.route('/api/products/export', methods=['GET'])
+def export_products():
+    """Stream every product matching the filters as NDJSON or CSV"""
+    try:
+        export_format = request.args.get('format', 'ndjson')
+        if export_format not in ('ndjson', 'csv'):
+            return json_response({
+                'error': 'Bad request',
+                'message': "format must be 'ndjson' or 'csv'"
+            }), 400
+
+        conn = get_db_connection()
+        try:
+            filters = get_product_filters()
+            select_list, join_clause = product_select(conn, request.args.get('fields'))
+        except ValueError as e:
+            return json_response({
+                'error': 'Bad request',
+                'message': str(e)
+            }), 400
+        from_clause, where_clause, params, _ = build_product_filter(filters, has_search_index=has_table(conn, 'products_fts'))
+        query = export_query(select_list, from_clause, join_clause, where_clause)
+
+        mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+        return Response(stream_export(query, params, export_format), mimetype=mimetype, headers={
+            'Content-Disposition': f'attachment; filename=products.{export_format}'
+        })
+        
+    except Exception as e:
+        return json_response({
             'error': 'Internal server error',
             'message': str(e)
         }), 500
@@ -141,136 +602,231 @@ def get_product(product_id):
     """Get a specific product by ID"""
     try:
         conn = get_db_connection()
+        try:
+            select_list, join_clause = product_select(conn, request.args.get('fields'))
+        except ValueError as e:
+            return json_response({
+                'error': 'Bad request',
+                'message': str(e)
+            }), 400
         
-        query = """
-            SELECT p.*, dc.name as distribution_center_name
+        query = f"""
+            SELECT {select_list}
             FROM products p
-            LEFT JOIN distribution_centers dc ON p.distribution_center_id = dc.id
+            {join_clause}
             WHERE p.id = ?
         """
         
-        cursor = conn.execute(query, (product_id,))
-        product = cursor.fetchone()
-        
-        conn.close()
+        cursor, rows = run_query(conn, 'products.get', query, (product_id,))
+        product = rows[0] if rows else None
         
         if product is None:
-            return jsonify({
+            return json_response({
                 'error': 'Product not found',
                 'message': f'No product found with ID {product_id}'
             }), 404
         
-        return jsonify({
-            'product': dict_from_row(product)
+        return json_response({
+            'product': row_as_dict(cursor, product)
         }), 200
         
     except Exception as e:
-        return jsonify({
+        return json_response({
+            'error': 'Internal server error',
+            'message': str(e)
+        }), 500
+
+@app.route('/api/products/batch', methods=['GET', 'POST'])
+def get_products_batch():
+    """Get many products by ID in one request, in the order requested"""
+    try:
+        # ids come from ?ids=1,2,3 or a JSON body {"ids": [1, 2, 3]}
+        if request.method == 'POST':
+            body = request.get_json(silent=True)
+            raw_ids = body.get('ids') if isinstance(body, dict) else None
+            if not isinstance(raw_ids, list):
+                return json_response({
+                    'error': 'Bad request',
+                    'message': 'Expected a JSON body like {"ids": [1, 2, 3]}'
+                }), 400
+        else:
+            raw_ids = [value for value in request.args.get('ids', '').split(',') if value.strip()]
+
+        try:
+            # int() would accept true/false and truncate 2.5
+            if any(isinstance(value, (bool, float)) for value in raw_ids):
+                raise ValueError
+            ids = [int(value) for value in raw_ids]
+        except (TypeError, ValueError):
+            return json_response({
+                'error': 'Bad request',
+                'message': 'ids must be integers'
+            }), 400
+        # Each id once, keeping the first position it was requested at
+        ids = list(dict.fromkeys(ids))
+        if not ids:
+            return json_response({
+                'error': 'Bad request',
+                'message': 'No ids given'
+            }), 400
+        if len(ids) > MAX_BATCH_IDS:
+            return json_response({
+                'error': 'Bad request',
+                'message': f'At most {MAX_BATCH_IDS} ids per request'
+            }), 400
+
+        conn = get_db_connection()
+        try:
+            select_list, join_clause = product_select(conn, request.args.get('fields'))
+        except ValueError as e:
+            return json_response({
+                'error': 'Bad request',
+                'message': str(e)
+            }), 400
+        
+        query = f"""
+            SELECT {select_list}
+            FROM products p
+            {join_clause}
+            WHERE p.id IN ({', '.join('?' * len(ids))})
+        """
+        
+        cursor, rows = run_query(conn, 'products.batch', query, ids)
+        found = {product['id']: product for product in rows_as_dicts(cursor, rows)}
+        
+        return json_response({
+            'products': [found[product_id] for product_id in ids if product_id in found],
+            'missing': [product_id for product_id in ids if product_id not in found],
+            'requested': len(ids)
+        }), 200
+        
+    except Exception as e:
+        return json_response({
             'error': 'Internal server error',
             'message': str(e)
         }), 500
 
 @app.route('/api/products/categories', methods=['GET'])
+@cached_response
 def get_categories():
     """Get all product categories with counts"""
     try:
         conn = get_db_connection()
         
-        query = """
-            SELECT category, COUNT(*) as count,
-                   AVG(retail_price) as avg_price,
-                   MIN(retail_price) as min_price,
-                   MAX(retail_price) as max_price
-            FROM products
-            WHERE category IS NOT NULL
-            GROUP BY category
-            ORDER BY count DESC
-        """
-        
-        cursor = conn.execute(query)
-        categories = [dict_from_row(row) for row in cursor.fetchall()]
+        if has_table(conn, 'category_summary'):
+            # Precomputed by the loader after every load
+            query = """
+                SELECT category, count, avg_price, min_price, max_price
+                FROM category_summary
+                ORDER BY position
+            """
+        else:
+            query = group_query('category', is_compact(conn))
         
-        conn.close()
+        cursor, rows = run_query(conn, 'categories', query)
+        categories = rows_as_dicts(cursor, rows)
         
-        return jsonify({
+        return json_response({
             'categories': categories,
             'total_categories': len(categories)
         }), 200
         
     except Exception as e:
-        return jsonify({
+        return json_response({
             'error': 'Internal server error',
             'message': str(e)
         }), 500
 
 @app.route('/api/products/brands', methods=['GET'])
+@cached_response
 def get_brands():
     """Get all product brands with counts"""
     try:
         conn = get_db_connection()
         
-        query = """
-            SELECT brand, COUNT(*) as count,
-                   AVG(retail_price) as avg_price
-            FROM products
-            WHERE brand IS NOT NULL
-            GROUP BY brand
-            ORDER BY count DESC
-            LIMIT 50
-        """
-        
-        cursor = conn.execute(query)
-        brands = [dict_from_row(row) for row in cursor.fetchall()]
-        
-        conn.close()
-        
-        return jsonify({
+        if has_table(conn, 'brand_summary'):
+            # Precomputed by the loader after every load
+            query = """
+                SELECT brand, count, avg_price
+                FROM brand_summary
+                ORDER BY position
+                LIMIT 50
+            """
+        else:
+            query = group_query('brand', is_compact(conn)) + " LIMIT 50"
+        
+        cursor, rows = run_query(conn, 'brands', query)
+        brands = rows_as_dicts(cursor, rows)
+        
+        return json_response({
             'brands': brands,
             'total_brands': len(brands)
         }), 200
         
     except Exception as e:
-        return jsonify({
+        return json_response({
             'error': 'Internal server error',
             'message': str(e)
         }), 500
 
 @app.route('/api/products/departments', methods=['GET'])
+@cached_response
 def get_departments():
     """Get all product departments with counts"""
     try:
         conn = get_db_connection()
         
-        query = """
-            SELECT department, COUNT(*) as count,
-                   AVG(retail_price) as avg_price
-            FROM products
-            WHERE department IS NOT NULL
-            GROUP BY department
-            ORDER BY count DESC
-        """
-        
-        cursor = conn.execute(query)
-        departments = [dict_from_row(row) for row in cursor.fetchall()]
+        if has_table(conn, 'department_summary'):
+            # Precomputed by the loader after every load
+            query = """
+                SELECT department, count, avg_price
+                FROM department_summary
+                ORDER BY position
+            """
+        else:
+            query = group_query('department', is_compact(conn))
         
-        conn.close()
+        cursor, rows = run_query(conn, 'departments', query)
+        departments = rows_as_dicts(cursor, rows)
         
-        return jsonify({
+        return json_response({
             'departments': departments,
             'total_departments': len(departments)
         }), 200
         
     except Exception as e:
-        return jsonify({
+        return json_response({
             'error': 'Internal server error',
             'message': str(e)
         }), 500
 
 @app.route('/api/products/stats', methods=['GET'])
+@cached_response
 def get_product_stats():
     """Get product statistics"""
     try:
         conn = get_db_connection()
+
+        if has_table(conn, 'product_stats_summary') and has_table(conn, 'price_distribution_summary'):
+            # Precomputed by the loader after every load
+            cursor, rows = run_query(conn, 'stats', """
+                SELECT total_products, total_categories, total_brands, total_departments,
+                       avg_price, min_price, max_price, premium_products
+                FROM product_stats_summary
+                WHERE id = 1
+            """)
+            stats = row_as_dict(cursor, rows[0] if rows else None)
+            cursor, rows = run_query(conn, 'stats.price_distribution', """
+                SELECT price_range, count
+                FROM price_distribution_summary
+                ORDER BY position
+            """)
+            price_distribution = rows_as_dicts(cursor, rows)
+
+            return json_response({
+                'statistics': stats,
+                'price_distribution': price_distribution
+            }), 200
         
         # Basic stats
         stats_query = """
@@ -287,8 +843,8 @@ def get_product_stats():
             WHERE retail_price IS NOT NULL
         """
         
-        cursor = conn.execute(stats_query)
-        stats = dict_from_row(cursor.fetchone())
+        cursor, rows = run_query(conn, 'stats', stats_query)
+        stats = row_as_dict(cursor, rows[0] if rows else None)
         
         # Price distribution
         price_dist_query = """
@@ -307,18 +863,16 @@ def get_product_stats():
             ORDER BY MIN(retail_price)
         """
         
-        cursor = conn.execute(price_dist_query)
-        price_distribution = [dict_from_row(row) for row in cursor.fetchall()]
-        
-        conn.close()
+        cursor, rows = run_query(conn, 'stats.price_distribution', price_dist_query)
+        price_distribution = rows_as_dicts(cursor, rows)
         
-        return jsonify({
+        return json_response({
             'statistics': stats,
             'price_distribution': price_distribution
         }), 200
         
     except Exception as e:
-        return jsonify({
+        return json_response({
             'error': 'Internal server error',
             'message': str(e)
         }), 500
@@ -326,7 +880,7 @@ def get_product_stats():
 @app.errorhandler(404)
 def not_found(error):
     """Handle 404 errors"""
-    return jsonify({
+    return json_response({
         'error': 'Not found',
         'message': 'The requested resource was not found'
     }), 404
@@ -334,7 +888,7 @@ def not_found(error):
 @app.errorhandler(500)
 def internal_error(error):
     """Handle 500 errors"""
-    return jsonify({
+    return json_response({
         'error': 'Internal server error',
         'message': 'An unexpected error occurred'
     }), 500
@@ -342,7 +896,7 @@ def internal_error(error):
 @app.errorhandler(400)
 def bad_request(error):
     """Handle 400 errors"""
-    return jsonify({
+    return json_response({
         'error': 'Bad request',
         'message': 'Invalid request parameters'
     }), 400
@@ -359,8 +913,11 @@ if __name__ == '__main__':
     print("🌐 API will be available at: http://localhost:5000")
     print("📖 API Documentation:")
     print("  - GET /api/health - Health check")
+    print("  - GET /api/metrics - Request and SQL metrics (Prometheus format)")
     print("  - GET /api/products - List all products (with pagination)")
     print("  - GET /api/products/{id} - Get specific product")
+    print("  - GET|POST /api/products/batch - Get many products by ID")
+    print("  - GET /api/products/export - Stream all products as NDJSON or CSV")
     print("  - GET /api/products/categories - Get all categories")
     print("  - GET /api/products/brands - Get all brands")
     print("  - GET /api/products/departments - Get all departments")
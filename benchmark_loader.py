@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Benchmark load_data_improved.py against the archive CSVs (or a scaled copy)
+and report per-table and per-stage timings, peak RSS and database size as JSON.
+
+The loader runs in a scratch directory, so the ecommerce.db next to this
+script is never touched. Loader output goes to stderr; the JSON report goes
+to stdout or --output.
+"""
+
+import argparse
+import contextlib
+import csv
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import load_data_improved as loader
+
+# Foreign-key columns and the table whose ids they hold. Replicated copies
+# of the archive shift these by the same offset as the referenced keys, so
+# every copy references its own rows. distribution_centers is not replicated.
+REFERENCES = {
+    'user_id': 'users',
+    'product_id': 'products',
+    'order_id': 'orders',
+    'inventory_item_id': 'inventory_items',
+}
+
+def key_column(table):
+    """Return the name of a table's KEY column"""
+    return next(column[0] for column in table['columns'] if column[1] == loader.KEY)
+
+def max_key(path, column):
+    """Return the largest integer value of a CSV column"""
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        position = next(reader).index(column)
+        return max((int(row[position]) for row in reader if row[position].isdigit()), default=0)
+
+def scale_archive(source, target, scale):
+    """Write a scaled copy of the archive CSVs into target
+
+    A scale below 1 keeps that fraction of the records of every file; a
+    whole-number scale above 1 appends copies with shifted ids.
+    """
+    os.makedirs(target, exist_ok=True)
+    if scale > 1 and scale != int(scale):
+        raise ValueError('scales above 1 must be whole numbers')
+
+    offsets = {}
+    for table in loader.TABLES:
+        path = os.path.join(source, os.path.basename(table['csv']))
+        offsets[table['name']] = max_key(path, key_column(table)) if scale > 1 else 0
+
+    for table in loader.TABLES:
+        name = table['name']
+        path = os.path.join(source, os.path.basename(table['csv']))
+        with open(path, newline='') as src, \
+                open(os.path.join(target, os.path.basename(path)), 'w', newline='') as dst:
+            reader = csv.reader(src)
+            writer = csv.writer(dst, lineterminator='\n')
+            header = next(reader)
+            writer.writerow(header)
+
+            if scale <= 1:
+                records = sum(1 for _ in reader)
+                src.seek(0)
+                reader = csv.reader(src)
+                next(reader)
+                for _, row in zip(range(round(records * scale)), reader):
+                    writer.writerow(row)
+                continue
+
+            copies = 1 if name == 'distribution_centers' else int(scale)
+            shifted = [(position, offsets[name]) for position, column in enumerate(header)
+                       if column == key_column(table)]
+            shifted += [(position, offsets[REFERENCES[column]])
+                        for position, column in enumerate(header) if column in REFERENCES]
+            for copy in range(copies):
+                src.seek(0)
+                reader = csv.reader(src)
+                next(reader)
+                for row in reader:
+                    for position, offset in shifted:
+                        # Malformed values are copied as-is for the loader to quarantine
+                        if row[position].isdigit():
+                            row[position] = str(int(row[position]) + copy * offset)
+                    writer.writerow(row)
+
+def peak_rss():
+    """Return the peak resident set size in bytes of this process and its children"""
+    if resource is None:
+        return {'loader': None, 'workers': None}
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return {
+        'loader': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit,
+        'workers': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit,
+    }
+
+def directory_size(path):
+    """Return the total size in bytes of the files in a directory"""
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names)
+
+def run_benchmark(archive='archive', scale=1.0, schema=loader.SCHEMA_FILE, bulk=True,
+                  batch_size=loader.BATCH_SIZE, workers=None, incremental=False,
+                  compact=False, workdir=None):
+    """Run one load in a scratch directory and return the benchmark report"""
+    archive = os.path.abspath(archive)
+    schema = os.path.abspath(schema)
+    scratch = workdir or tempfile.mkdtemp(prefix='loader-benchmark-')
+    try:
+        return benchmark_in(scratch, archive, scale, schema, bulk, batch_size,
+                            workers, incremental, compact)
+    finally:
+        if workdir is None:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+def benchmark_in(scratch, archive, scale, schema, bulk, batch_size, workers, incremental, compact):
+    """Run one load in the given directory and return the benchmark report"""
+    os.makedirs(scratch, exist_ok=True)
+    shutil.copy(schema, os.path.join(scratch, loader.SCHEMA_FILE))
+
+    # Never write a scaled copy through a link to the real archive
+    scaled_archive = os.path.join(scratch, 'archive')
+    if os.path.islink(scaled_archive):
+        os.remove(scaled_archive)
+    stage_start = time.perf_counter()
+    if scale == 1:
+        if not os.path.exists(scaled_archive):
+            os.symlink(archive, scaled_archive, target_is_directory=True)
+    else:
+        scale_archive(archive, scaled_archive, scale)
+    scale_seconds = time.perf_counter() - stage_start
+
+    cwd = os.getcwd()
+    os.chdir(scratch)
+    try:
+        started_at = datetime.now(timezone.utc)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(sys.stderr):
+            published = loader.create_database(bulk=bulk, batch_size=batch_size,
+                                               workers=workers, incremental=incremental,
+                                               compact=compact)
+        wall = time.perf_counter() - start
+        db_size = os.path.getsize(loader.DATABASE) if os.path.exists(loader.DATABASE) else None
+    finally:
+        os.chdir(cwd)
+
+    return {
+        'started_at': started_at.isoformat(),
+        'config': {
+            'mode': 'incremental' if incremental else 'bulk' if bulk else 'row-by-row',
+            'batch_size': batch_size,
+            'workers': loader.default_workers() if workers is None else workers,
+            'compact': compact,
+            'archive': archive,
+            'scale': scale,
+        },
+        'published': published,
+        'input_bytes': directory_size(scaled_archive),
+        'db_size_bytes': db_size,
+        'wall_seconds': wall,
+        'scale_seconds': scale_seconds,
+        'stages': dict(loader.LOAD_STATS['stages']),
+        'tables': {name: dict(stats) for name, stats in loader.LOAD_STATS['tables'].items()},
+        'peak_rss_bytes': peak_rss(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the CSV loader and print a JSON report')
+    parser.add_argument('--archive', default='archive',
+                        help='directory with the source CSV files (default: archive)')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='fraction of the records to load, or a whole number of id-shifted copies (default: 1)')
+    parser.add_argument('--schema', default=loader.SCHEMA_FILE,
+                        help=f'schema file (default: {loader.SCHEMA_FILE})')
+    parser.add_argument('--batch-size', type=int, default=loader.BATCH_SIZE,
+                        help=f'rows per executemany batch in bulk mode (default: {loader.BATCH_SIZE})')
+    parser.add_argument('--row-by-row', action='store_true',
+                        help='benchmark the row-by-row path')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='CSV parser processes (default: cores - 1)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='benchmark an incremental load (use with --workdir to reuse an earlier run)')
+    parser.add_argument('--compact', action='store_true',
+                        help='benchmark the compact storage layout')
+    parser.add_argument('--workdir', default=None,
+                        help='run in this directory and keep it (default: a temporary directory that is removed)')
+    parser.add_argument('--output', default=None,
+                        help='write the JSON report to this file instead of stdout')
+    args = parser.parse_args()
+
+    report = run_benchmark(archive=args.archive, scale=args.scale, schema=args.schema,
+                           bulk=not args.row_by_row, batch_size=args.batch_size,
+                           workers=args.workers, incremental=args.incremental,
+                           compact=args.compact, workdir=args.workdir)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+        print(f"Benchmark report written to {args.output}", file=sys.stderr)
+    else:
+        print(text)
+    sys.exit(0 if report['published'] else 1)
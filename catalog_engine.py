@@ -0,0 +1,299 @@
+"""
+In-memory columnar copy of the product catalog for the listing endpoint.
+
+The products table is small enough to hold in the API process. Every
+product (joined with its distribution center name, like the SQL listing) is
+loaded once per data generation into per-column storage:
+
+    ids           array of int64, ascending; a product's position is its index
+    prices        array of float64, NaN for NULL, for the price-range filter
+    codes         array of int32 dictionary codes for category, brand,
+                  department and distribution_center_name (-1 for NULL)
+    postings      per category/brand/department value, the array of positions
+                  with that value, in id order
+    by_price      positions sorted by price, with the sorted prices beside
+                  them, so a price range is two bisections
+
+A filter becomes an array of matching positions in id order: the shortest
+posting list of its equality filters (or the price range, or everything)
+checked against the remaining conditions. Matches are cached per filter, so
+paging through one result set only slices an array and builds the page's
+dicts. Text search is not held in memory; those requests go to SQLite.
+"""
+
+import sqlite3
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+
+from product_queries import DEFAULT_SELECT, DISTRIBUTION_CENTER_JOIN, PRICE_RANGE_BOUNDS, PRICE_RANGES, facet_counts
+from response_cache import GenerationCache
+
+# Columns stored as dictionary codes; the first three are filters and facets
+DICTIONARY_COLUMNS = ('category', 'brand', 'department', 'distribution_center_name')
+EQUALITY_FILTERS = ('category', 'brand', 'department')
+
+NULL_CODE = -1
+
+def filter_key(filters):
+    """Return the part of a filter dict the catalog answers, as a hashable key"""
+    return (tuple(filters.get(name) for name in EQUALITY_FILTERS),
+            filters.get('min_price'), filters.get('max_price'))
+
+class ProductCatalog:
+    """Every product of one data generation, held column by column"""
+
+    def __init__(self, generation, columns, rows):
+        self.generation = generation
+        self.columns = columns
+        self.size = len(rows)
+        index = {name: position for position, name in enumerate(columns)}
+
+        self.ids = array('q', (row[index['id']] for row in rows))
+        self.prices = array('d', (float('nan') if row[index['retail_price']] is None
+                                  else row[index['retail_price']] for row in rows))
+
+        self.dictionaries = {}
+        self.lookups = {}
+        self.codes = {}
+        self.postings = {}
+        for name in DICTIONARY_COLUMNS:
+            if name not in index:
+                continue
+            values = []
+            lookup = {}
+            codes = array('i')
+            postings = {}
+            for position, row in enumerate(rows):
+                value = row[index[name]]
+                if value is None:
+                    codes.append(NULL_CODE)
+                    continue
+                code = lookup.get(value)
+                if code is None:
+                    code = lookup[value] = len(values)
+                    values.append(value)
+                    postings[value] = array('i')
+                codes.append(code)
+                postings[value].append(position)
+            self.dictionaries[name] = values
+            self.lookups[name] = lookup
+            self.codes[name] = codes
+            if name in EQUALITY_FILTERS:
+                self.postings[name] = postings
+
+        # Every other column is kept as a tuple of its values
+        self.values = {name: tuple(row[index[name]] for row in rows)
+                       for name in columns if name not in self.codes}
+
+        priced = sorted((price, position) for position, price in enumerate(self.prices) if price == price)
+        self.by_price = array('i', (position for _, position in priced))
+        self.sorted_prices = array('d', (price for price, _ in priced))
+
+        self.all_positions = array('i', range(self.size))
+
+        # Matches and facet counts by filter
+        self._matches = GenerationCache(max_entries=256, max_bytes=16 * 1024 * 1024)
+
+    @classmethod
+    def load(cls, database, generation):
+        """Read every product from a database file into a new catalog"""
+        conn = sqlite3.connect(f'file:{database}?mode=ro', uri=True)
+        try:
+            cursor = conn.execute(f"SELECT {DEFAULT_SELECT} FROM products p {DISTRIBUTION_CENTER_JOIN} ORDER BY p.id")
+            columns = [description[0] for description in cursor.description]
+            return cls(generation, columns, cursor.fetchall())
+        finally:
+            conn.close()
+
+    def select_columns(self, fields):
+        """Return the columns for a fields= parameter, as product_select in app.py does
+
+        Raises ValueError for unknown fields.
+        """
+        if not fields:
+            return self.columns
+        requested = [field.strip() for field in fields.split(',') if field.strip()]
+        unknown = [field for field in requested if field not in self.columns]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        return list(dict.fromkeys(['id'] + requested))
+
+    def match(self, filters):
+        """Return the positions of the products matching filters, in id order
+
+        filters is the dict app.get_product_filters() returns; search must
+        not be set.
+        """
+        key = filter_key(filters)
+        matches = self._matches.get(key, self.generation)
+        if matches is None:
+            matches = self._match(filters)
+            self._matches.put(key, self.generation, matches, matches.itemsize * len(matches))
+        return matches
+
+    def _match(self, filters):
+        min_price = filters.get('min_price')
+        max_price = filters.get('max_price')
+        # Equality filters as (posting list, codes, wanted code)
+        conditions = []
+        for name in EQUALITY_FILTERS:
+            value = filters.get(name)
+            if not value:
+                continue
+            postings = self.postings.get(name, {}).get(value)
+            if postings is None:
+                return array('i')
+            conditions.append((postings, self.codes[name], self.lookups[name][value]))
+
+        priced = min_price is not None or max_price is not None
+        if not conditions:
+            if not priced:
+                return self.all_positions
+            low = 0 if min_price is None else bisect_left(self.sorted_prices, min_price)
+            high = len(self.sorted_prices) if max_price is None else bisect_right(self.sorted_prices, max_price)
+            return array('i', sorted(self.by_price[low:high]))
+
+        # The shortest posting list drives; the other conditions check codes
+        conditions.sort(key=lambda condition: len(condition[0]))
+        positions = conditions[0][0]
+        for _, codes, code in conditions[1:]:
+            positions = [position for position in positions if codes[position] == code]
+        if priced:
+            prices = self.prices
+            low = float('-inf') if min_price is None else min_price
+            high = float('inf') if max_price is None else max_price
+            # NaN (NULL) prices fail the comparison, as NULL does in SQL
+            positions = [position for position in positions if low <= prices[position] <= high]
+        return positions if isinstance(positions, array) else array('i', positions)
+
+    def products(self, positions, columns):
+        """Return the products at positions as dicts of the given columns"""
+        getters = []
+        for name in columns:
+            if name in self.codes:
+                codes, values = self.codes[name], self.dictionaries[name]
+                getters.append((name, lambda position, codes=codes, values=values:
+                                None if codes[position] == NULL_CODE else values[codes[position]]))
+            else:
+                getters.append((name, self.values[name].__getitem__))
+        return [{name: get(position) for name, get in getters} for position in positions]
+
+    def page(self, matches, offset, limit, columns):
+        """Return up to limit matching products starting at offset"""
+        return self.products(matches[offset:offset + limit], columns)
+
+    def page_after(self, matches, after_id, limit, columns):
+        """Return up to limit matching products with an id greater than after_id"""
+        start = bisect_right(matches, after_id, key=self.ids.__getitem__)
+        return self.products(matches[start:start + limit], columns)
+
+    def facets(self, filters, facets):
+        """Return facet counts for the products matching filters, as product_queries.facet_counts does"""
+        key = ('facets', filter_key(filters), facets)
+        result = self._matches.get(key, self.generation)
+        if result is None:
+            result = self._facets(self.match(filters), facets)
+            self._matches.put(key, self.generation, result)
+        return result
+
+    def _facets(self, matches, facets):
+        result = {}
+        for name in facets:
+            if name == 'price':
+                counts = [0] * len(PRICE_RANGES)
+                prices = self.prices
+                for position in matches:
+                    price = prices[position]
+                    if price == price:
+                        counts[bisect_right(PRICE_RANGE_BOUNDS, price)] += 1
+                rows = [(label, count) for label, count in zip(PRICE_RANGES, counts) if count]
+            else:
+                counts = [0] * len(self.dictionaries[name])
+                codes = self.codes[name]
+                for position in matches:
+                    code = codes[position]
+                    if code != NULL_CODE:
+                        counts[code] += 1
+                rows = [(value, count) for value, count in zip(self.dictionaries[name], counts) if count]
+            result.update(facet_counts(rows, (name,)))
+        return result
+
+class CatalogEngine:
+    """Keeps a ProductCatalog of the current data generation"""
+
+    def __init__(self, database, get_generation):
+        self.database = database
+        self.get_generation = get_generation
+        self._catalog = None
+        self._loading = threading.Lock()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._stats = {'loads': 0, 'fallbacks': 0}
+
+    def get(self):
+        """Return the catalog of the current generation, or None while it is being loaded
+
+        A generation not loaded yet is loaded by the first caller to see it;
+        requests arriving meanwhile get None and are answered from SQLite
+        instead of waiting.
+        """
+        generation = self.get_generation()
+        catalog = self._catalog
+        if catalog is not None and catalog.generation == generation:
+            return catalog
+        if not self._loading.acquire(blocking=False):
+            with self._lock:
+                self._stats['fallbacks'] += 1
+            return None
+        try:
+            return self._load(generation)
+        finally:
+            self._loading.release()
+
+    def warm(self):
+        """Load the current generation unless it is loaded, waiting for a load in progress"""
+        generation = self.get_generation()
+        with self._loading:
+            return self._load(generation)
+
+    def _load(self, generation):
+        # Called with _loading held
+        catalog = self._catalog
+        if catalog is None or catalog.generation != generation:
+            catalog = self._catalog = ProductCatalog.load(self.database, generation)
+            with self._lock:
+                self._stats['loads'] += 1
+        return catalog
+
+    def start(self, interval=1.0):
+        """Warm the catalog in a background thread, now and after every new generation
+
+        The thread checks the generation every interval seconds, so the
+        catalog is usually loaded before the first request that needs it.
+        """
+        thread = threading.Thread(target=self._watch, args=(interval,), name='catalog-engine', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        """Stop the thread started by start()"""
+        self._stopped.set()
+
+    def _watch(self, interval):
+        while not self._stopped.is_set():
+            try:
+                self.warm()
+            except sqlite3.Error:
+                # No database yet, or one replaced mid-read: retried on the next check
+                pass
+            self._stopped.wait(interval)
+
+    def stats(self):
+        """Return the engine counters and the size of the loaded catalog"""
+        catalog = self._catalog
+        with self._lock:
+            stats = dict(self._stats)
+        return dict(stats,
+                    generation=catalog.generation if catalog else None,
+                    products=catalog.size if catalog else 0)
@@ -0,0 +1,111 @@
+"""
+Pool of reusable read-only SQLite connections for the API.
+
+Opening a connection per request pays for the file open, the schema parse
+and a cold page cache every time. The pool keeps idle connections around
+and hands them out again, configured once with query_only, mmap and cache
+size settings.
+
+The loader publishes new data by renaming a new file over the database, and
+a connection that is already open keeps reading the old file. Every
+connection is therefore tagged with the data generation it was opened on;
+idle connections from an older generation are closed when a newer one is
+seen, and busy ones are closed instead of returned.
+"""
+
+import queue
+import sqlite3
+import threading
+
+# Connection settings applied once when a connection is opened
+MMAP_SIZE = 256 * 1024 * 1024   # map up to 256 MB of the file
+CACHE_SIZE = -32000             # ~32 MB page cache per connection
+
+class ConnectionPool:
+    """Thread-safe pool of read-only connections to one database path"""
+
+    def __init__(self, database, get_generation, size=8):
+        self.database = database
+        self.get_generation = get_generation
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._generation = None
+        self._stats = {
+            'opened': 0,
+            'reused': 0,
+            'recycled': 0,
+            'closed': 0,
+            'in_use': 0,
+        }
+
+    def _connect(self):
+        conn = sqlite3.connect(f'file:{self.database}?mode=ro', uri=True,
+                               check_same_thread=False)
+        # Rows are plain tuples; serialization.py maps them to column names
+        conn.execute('PRAGMA query_only = ON')
+        conn.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+        conn.execute(f'PRAGMA cache_size = {CACHE_SIZE}')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        return conn
+
+    def _drain(self):
+        """Close every idle connection, returning how many were closed"""
+        drained = 0
+        while True:
+            try:
+                _, conn = self._idle.get_nowait()
+            except queue.Empty:
+                return drained
+            conn.close()
+            drained += 1
+
+    def acquire(self):
+        """Return (connection, generation) for the current database generation"""
+        generation = self.get_generation()
+        with self._lock:
+            if generation != self._generation:
+                # The file was replaced: connections to the old one must go
+                self._stats['recycled'] += self._drain()
+                self._generation = generation
+            self._stats['in_use'] += 1
+        try:
+            _, conn = self._idle.get_nowait()
+            with self._lock:
+                self._stats['reused'] += 1
+        except queue.Empty:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._lock:
+                    self._stats['in_use'] -= 1
+                raise
+            with self._lock:
+                self._stats['opened'] += 1
+        return conn, generation
+
+    def release(self, conn, generation):
+        """Give a connection back, closing it if it is stale or the pool is full"""
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            self._stats['in_use'] -= 1
+            if generation != self._generation:
+                self._stats['recycled'] += 1
+            elif self._idle.qsize() < self.size:
+                self._idle.put((generation, conn))
+                return
+            else:
+                self._stats['closed'] += 1
+        conn.close()
+
+    def close(self):
+        """Close every idle connection"""
+        with self._lock:
+            self._stats['closed'] += self._drain()
+
+    def stats(self):
+        """Return the pool counters"""
+        with self._lock:
+            return dict(self._stats, size=self.size, idle=self._idle.qsize(),
+                        generation=self._generation)
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Export the large tables of ecommerce.db as a columnar snapshot for analytics.
+
+Every column is written to its own file of little-endian fixed-width values
+that can be memory-mapped directly (numpy.memmap, or load_column below):
+
+    snapshot/
+        manifest.json                 # generation, row counts, column types
+        order_items/
+            sale_price.f8             # float64, NaN for NULL
+            user_id.i8                # int64, INT64_MIN for NULL
+            status.codes.i4           # int32 codes, -1 for NULL
+            status.dict.json          # code -> string
+
+Text timestamps are left out when the table has the integer *_epoch column
+derived from them. Each snapshot is built in its own versioned directory
+next to the target (snapshot.v<timestamp>/), and snapshot is a symlink that
+is pointed at the finished version with one rename, so readers always find
+a complete snapshot there. A reader that opens several files should resolve
+the link once (os.path.realpath) so they all come from the same version.
+"""
+
+import argparse
+import json
+import mmap
+import os
+import shutil
+import sqlite3
+import sys
+import time
+from array import array
+from datetime import datetime, timezone
+
+DATABASE = 'ecommerce.db'
+SNAPSHOT_DIR = 'snapshot'
+
+# The tables analysts scan in full
+DEFAULT_TABLES = ['order_items', 'inventory_items', 'orders']
+
+# Rows fetched from SQLite per round trip
+FETCH_SIZE = 50000
+
+INT64_NULL = -2 ** 63
+CODE_NULL = -1
+
+# Column storage: array typecode, file suffix, numpy dtype, NULL value
+STORAGE = {
+    'int64': ('q', 'i8', '<i8', INT64_NULL),
+    'float64': ('d', 'f8', '<f8', float('nan')),
+    'string': ('i', 'codes.i4', '<i4', CODE_NULL),
+}
+
+def column_kind(declared_type):
+    """Map a declared SQLite column type to a snapshot storage kind"""
+    declared = (declared_type or '').upper()
+    if 'INT' in declared:
+        return 'int64'
+    if any(name in declared for name in ('REAL', 'FLOA', 'DOUB', 'DEC')):
+        return 'float64'
+    return 'string'
+
+def snapshot_columns(conn, table):
+    """Return [(column, kind)] for the columns of a table that are exported"""
+    info = [(row[1], row[2]) for row in conn.execute(f"PRAGMA table_info({table})")]
+    names = {name for name, _ in info}
+    return [(name, column_kind(declared)) for name, declared in info
+            if f'{name}_epoch' not in names]
+
+class ColumnWriter:
+    """Append the values of one column to its typed array file"""
+
+    def __init__(self, directory, name, kind):
+        self.name = name
+        self.kind = kind
+        typecode, suffix, dtype, self.null = STORAGE[kind]
+        self.file_name = f'{name}.{suffix}'
+        self.dtype = dtype
+        self.file = open(os.path.join(directory, self.file_name), 'wb')
+        self.buffer = array(typecode)
+        self.dictionary = {} if kind == 'string' else None
+        self.directory = directory
+
+    def extend(self, values):
+        null = self.null
+        if self.kind == 'string':
+            codes = self.dictionary
+            for value in values:
+                if value is None:
+                    self.buffer.append(null)
+                    continue
+                value = str(value)
+                code = codes.get(value)
+                if code is None:
+                    code = codes[value] = len(codes)
+                self.buffer.append(code)
+        elif self.kind == 'int64':
+            self.buffer.extend(null if value is None else int(value) for value in values)
+        else:
+            self.buffer.extend(null if value is None else float(value) for value in values)
+        self.flush()
+
+    def flush(self):
+        if sys.byteorder != 'little':
+            self.buffer.byteswap()
+        self.buffer.tofile(self.file)
+        del self.buffer[:]
+
+    def close(self):
+        self.file.close()
+        entry = {'type': self.kind, 'file': self.file_name, 'dtype': self.dtype}
+        if self.kind == 'string':
+            entry['dictionary'] = f'{self.name}.dict.json'
+            entry['null'] = CODE_NULL
+            with open(os.path.join(self.directory, entry['dictionary']), 'w') as f:
+                json.dump(list(self.dictionary), f)
+        elif self.kind == 'int64':
+            entry['null'] = INT64_NULL
+        else:
+            entry['null'] = 'NaN'
+        return entry
+
+def export_table(conn, table, directory):
+    """Write one table's columns into directory and return its manifest entry"""
+    os.makedirs(directory)
+    columns = snapshot_columns(conn, table)
+    writers = [ColumnWriter(directory, name, kind) for name, kind in columns]
+    cursor = conn.execute(f"SELECT {', '.join(name for name, _ in columns)} FROM {table}")
+    rows = 0
+    while True:
+        batch = cursor.fetchmany(FETCH_SIZE)
+        if not batch:
+            break
+        rows += len(batch)
+        for writer, values in zip(writers, zip(*batch)):
+            writer.extend(values)
+    return {
+        'rows': rows,
+        'columns': {writer.name: writer.close() for writer in writers},
+    }
+
+def export_snapshot(db_path=DATABASE, snapshot_dir=SNAPSHOT_DIR, tables=None):
+    """Write a columnar snapshot of the given tables and swap it into snapshot_dir"""
+    tables = tables or DEFAULT_TABLES
+    building = f"{snapshot_dir}.v{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')}"
+    os.makedirs(building)
+
+    start = time.perf_counter()
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    try:
+        try:
+            row = conn.execute("SELECT value FROM load_metadata WHERE key = 'generation'").fetchone()
+            generation = row[0] if row else None
+        except sqlite3.OperationalError:
+            generation = None
+        manifest = {
+            'generation': generation,
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'byteorder': 'little',
+            'tables': {},
+        }
+        for table in tables:
+            table_start = time.perf_counter()
+            manifest['tables'][table] = export_table(conn, table, os.path.join(building, table))
+            print(f"  {table}: {manifest['tables'][table]['rows']} rows, "
+                  f"{len(manifest['tables'][table]['columns'])} columns "
+                  f"in {time.perf_counter() - table_start:.2f}s")
+    finally:
+        conn.close()
+
+    with open(os.path.join(building, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    publish_snapshot(building, snapshot_dir)
+    print(f"✅ Columnar snapshot written to {snapshot_dir}/ in {time.perf_counter() - start:.1f}s")
+    return manifest
+
+def remove_snapshot(path, keep):
+    """Remove a snapshot directory, or a symlink to one and the directory it points to
+
+    keep (the version being published) is never removed.
+    """
+    if os.path.islink(path):
+        target = os.path.join(os.path.dirname(path), os.readlink(path))
+        os.remove(path)
+        path = target
+    if os.path.isdir(path) and not os.path.samefile(path, keep):
+        shutil.rmtree(path, ignore_errors=True)
+
+def publish_snapshot(version_dir, snapshot_dir):
+    """Point the snapshot_dir symlink at version_dir and remove the version it replaced
+
+    The new link is created beside snapshot_dir and renamed over it, which
+    replaces the old link atomically. Only the version the old link pointed
+    to (or the plain directory it replaced) is removed, once the swap is
+    done; other snapshot.v* directories, such as one another export is
+    still writing, are left alone. Readers holding a mapped file keep the
+    old data after its version is removed.
+    """
+    previous = snapshot_dir + '.previous'
+    if os.path.lexists(previous):
+        # Left by an interrupted publish; nothing reads it
+        remove_snapshot(previous, version_dir)
+
+    link = snapshot_dir + '.link'
+    if os.path.lexists(link):
+        os.remove(link)
+    try:
+        os.symlink(os.path.basename(version_dir), link, target_is_directory=True)
+    except OSError:
+        # No symlinks (Windows without the privilege): swap with two renames,
+        # leaving snapshot_dir missing for a moment
+        link = None
+
+    # The version being replaced, read before the swap
+    old_version = None
+    if os.path.islink(snapshot_dir):
+        old_version = os.path.join(os.path.dirname(snapshot_dir), os.readlink(snapshot_dir))
+
+    if os.path.lexists(snapshot_dir) and (link is None or not os.path.islink(snapshot_dir)):
+        # Only a link can be renamed over a link; a plain directory (from
+        # before snapshots were versioned, or the fallback) is moved aside
+        os.replace(snapshot_dir, previous)
+    os.replace(link or version_dir, snapshot_dir)
+
+    published = snapshot_dir if link is None else version_dir
+    if os.path.lexists(previous):
+        remove_snapshot(previous, published)
+    if old_version is not None and os.path.isdir(old_version):
+        remove_snapshot(old_version, published)
+
+def load_manifest(snapshot_dir=SNAPSHOT_DIR):
+    """Read a snapshot's manifest"""
+    with open(os.path.join(snapshot_dir, 'manifest.json')) as f:
+        return json.load(f)
+
+def load_column(snapshot_dir, table, column, manifest=None):
+    """Memory-map one column of a snapshot
+
+    Returns (values, dictionary): values is a read-only memoryview of the
+    int64/float64/int32 array, dictionary the list of strings the int32
+    codes of a string column refer to (None for numeric columns).
+    """
+    manifest = manifest or load_manifest(snapshot_dir)
+    entry = manifest['tables'][table]['columns'][column]
+    directory = os.path.join(snapshot_dir, table)
+    typecode = STORAGE[entry['type']][0]
+
+    dictionary = None
+    if 'dictionary' in entry:
+        with open(os.path.join(directory, entry['dictionary'])) as f:
+            dictionary = json.load(f)
+
+    with open(os.path.join(directory, entry['file']), 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return memoryview(array(typecode)), dictionary
+        # The mapping stays valid after the file is closed
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if sys.byteorder != 'little':
+        values = array(typecode, mapped)
+        values.byteswap()
+        return memoryview(values), dictionary
+    return memoryview(mapped).cast(typecode), dictionary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Export a columnar snapshot of ecommerce.db')
+    parser.add_argument('--database', default=DATABASE,
+                        help=f'database to export (default: {DATABASE})')
+    parser.add_argument('--output', default=SNAPSHOT_DIR,
+                        help=f'snapshot directory (default: {SNAPSHOT_DIR})')
+    parser.add_argument('--tables', nargs='+', default=DEFAULT_TABLES,
+                        help=f"tables to export (default: {' '.join(DEFAULT_TABLES)})")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        print(f"❌ Error: Database file '{args.database}' not found!")
+        sys.exit(1)
+    print(f"Exporting {', '.join(args.tables)} from {args.database}...")
+    export_snapshot(args.database, args.output, args.tables)
@@ -1,230 +1,1184 @@
 import sqlite3
 import csv
+import io
 import os
-from datetime import datetime
+import re
+import time
+import hashlib
+import argparse
+from collections import deque
+from datetime import datetime, timezone
+from itertools import islice
+from multiprocessing import Pool
 
-def create_database():
+from export_columnar import SNAPSHOT_DIR, export_snapshot
+from product_queries import GROUP_AGGREGATES, group_query
+from verify_setup import verify_database_setup
+
+DATABASE = 'ecommerce.db'
+SCHEMA_FILE = 'database_schema.sql'
+
+# New data is loaded into this file next to the live database, verified,
+# and then renamed over DATABASE so the API never sees a half-loaded file
+BUILD_DATABASE = DATABASE + '.building'
+
+# Rows sent to each executemany call in bulk mode
+BATCH_SIZE = 5000
+
+# CSV records handed to a parser worker at a time
+CHUNK_LINES = 20000
+
+# Loader-time settings: the database is rebuilt from the CSVs anyway, so
+# durability is traded for speed while the build is written. None of these
+# is stored in the database file (only WAL journal mode would be), so the
+# API opens the published file with SQLite's defaults. The build is not
+# durable until publish_database flushes it to disk before the rename.
+BULK_PRAGMAS = [
+    ('journal_mode', 'MEMORY'),
+    ('synchronous', 'OFF'),
+    ('cache_size', -200000),  # ~200 MB page cache
+    ('temp_store', 'MEMORY'),
+]
+
+# Incremental loads commit every batch and must survive a crash, so they
+# keep an on-disk rollback journal
+INCREMENTAL_PRAGMAS = [
+    ('journal_mode', 'DELETE'),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -200000),
+    ('temp_store', 'MEMORY'),
+]
+
+# Rejected CSV rows are written to <QUARANTINE_DIR>/<table>.csv with the reason
+QUARANTINE_DIR = 'quarantine'
+
+# Column types for the table specs below, as Python expressions over one
+# CSV field. Integer columns other than the key treat non-numeric values
+# as NULL; float and key columns reject the row instead.
+KEY = 'key'
+INT = 'int'
+FLOAT = 'float'
+TEXT = 'text'    # empty string becomes NULL
+STR = 'str'      # stored as-is
+EPOCH = 'epoch'  # timestamp as integer Unix seconds, unparseable values become NULL
+CONVERSIONS = {
+    KEY: 'int({0})',
+    INT: '(int({0}) if {0}.isdigit() else None)',
+    FLOAT: '(float({0}) if {0} else None)',
+    TEXT: '({0} or None)',
+    STR: '{0}',
+    EPOCH: 'to_epoch({0})',
+}
+
+# SQL types for columns the loader adds to tables that the schema file
+# doesn't define (see add_missing_columns)
+COLUMN_TYPES = {KEY: 'INTEGER', INT: 'INTEGER', FLOAT: 'REAL', TEXT: 'TEXT', STR: 'TEXT', EPOCH: 'INTEGER'}
+
+# Indexes on the loader-added epoch columns, built with the schema's indexes
+LOADER_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_orders_created_at_epoch ON orders(created_at_epoch)",
+    "CREATE INDEX IF NOT EXISTS idx_order_items_created_at_epoch ON order_items(created_at_epoch)",
+    "CREATE INDEX IF NOT EXISTS idx_inventory_items_created_at_epoch ON inventory_items(created_at_epoch)",
+]
+
+# Full-text index behind the API's product search. It reads its text from
+# products (external content), so only the index itself is stored; prefix
+# indexes make 2- and 3-character prefix queries cheap.
+SEARCH_INDEX_SCHEMA = """
+    DROP TABLE IF EXISTS products_fts;
+    CREATE VIRTUAL TABLE products_fts USING fts5(
+        name, brand, category,
+        content='products', content_rowid='id',
+        prefix='2 3', tokenize='unicode61 remove_diacritics 2'
+    );
+"""
+
+# Aggregates behind the API's stats and category/brand/department
+# endpoints, recomputed from products after every load. Rows are stored in
+# the order the endpoints return them.
+SUMMARY_SCHEMA = """
+    DROP TABLE IF EXISTS product_stats_summary;
+    CREATE TABLE product_stats_summary (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        total_products INTEGER,
+        total_categories INTEGER,
+        total_brands INTEGER,
+        total_departments INTEGER,
+        avg_price REAL,
+        min_price REAL,
+        max_price REAL,
+        premium_products INTEGER
+    );
+    INSERT INTO product_stats_summary
+    SELECT
+        1,
+        COUNT(*),
+        COUNT(DISTINCT category),
+        COUNT(DISTINCT brand),
+        COUNT(DISTINCT department),
+        AVG(retail_price),
+        MIN(retail_price),
+        MAX(retail_price),
+        SUM(CASE WHEN retail_price > 100 THEN 1 ELSE 0 END)
+    FROM products
+    WHERE retail_price IS NOT NULL;
+
+    DROP TABLE IF EXISTS price_distribution_summary;
+    CREATE TABLE price_distribution_summary (
+        position INTEGER PRIMARY KEY,
+        price_range TEXT NOT NULL,
+        count INTEGER NOT NULL
+    );
+    INSERT INTO price_distribution_summary
+    SELECT ROW_NUMBER() OVER (ORDER BY MIN(retail_price)), price_range, COUNT(*)
+    FROM (
+        SELECT retail_price,
+            CASE
+                WHEN retail_price < 25 THEN 'Under $25'
+                WHEN retail_price < 50 THEN '$25-$50'
+                WHEN retail_price < 100 THEN '$50-$100'
+                WHEN retail_price < 200 THEN '$100-$200'
+                ELSE 'Over $200'
+            END AS price_range
+        FROM products
+        WHERE retail_price IS NOT NULL
+    )
+    GROUP BY price_range;
+
+    DROP TABLE IF EXISTS category_summary;
+    CREATE TABLE category_summary (
+        position INTEGER PRIMARY KEY,
+        category TEXT NOT NULL UNIQUE,
+        count INTEGER NOT NULL,
+        avg_price REAL,
+        min_price REAL,
+        max_price REAL
+    );
+
+    DROP TABLE IF EXISTS brand_summary;
+    CREATE TABLE brand_summary (
+        position INTEGER PRIMARY KEY,
+        brand TEXT NOT NULL UNIQUE,
+        count INTEGER NOT NULL,
+        avg_price REAL
+    );
+
+    DROP TABLE IF EXISTS department_summary;
+    CREATE TABLE department_summary (
+        position INTEGER PRIMARY KEY,
+        department TEXT NOT NULL UNIQUE,
+        count INTEGER NOT NULL,
+        avg_price REAL
+    );
+"""
+
+# Per-table load state: how much of each CSV file is in the database and
+# a fingerprint of that part of the file
+LOAD_STATE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS load_state (
+        table_name TEXT PRIMARY KEY,
+        file_size INTEGER,
+        file_mtime REAL,
+        bytes_loaded INTEGER,
+        prefix_hash TEXT,
+        last_id INTEGER,
+        row_count INTEGER,
+        updated_at TEXT
+    )
+"""
+
+# Matches the start of a CREATE INDEX statement, including leading comments
+INDEX_STATEMENT = re.compile(
+    r'^(?:\s*--[^\n]*\n)*\s*CREATE\s+(UNIQUE\s+)?INDEX\s+(?:IF\s+NOT\s+EXISTS\s+)?',
+    re.IGNORECASE
+)
+
+# Key/value facts about the loaded data. 'generation' changes every time a
+# new database is published, which tells app.py to drop anything cached.
+# INCREMENTAL_BUILD_KEY marks a build copy an incremental load is still
+# writing, the only kind of leftover build it may resume.
+LOAD_METADATA_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS load_metadata (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    ) WITHOUT ROWID
+"""
+INCREMENTAL_BUILD_KEY = 'incremental_build'
+
+# Compact layout: repeated categorical text in products is replaced by ids
+# into small lookup tables, inventory_items stops duplicating its product's
+# columns, and views with the original table names keep queries working
+LOOKUP_TABLES = [
+    # (lookup table, products column)
+    ('categories', 'category'),
+    ('brands', 'brand'),
+    ('departments', 'department'),
+]
+
+# Target table of a CREATE INDEX statement
+INDEX_TARGET = re.compile(r'\bON\s+["`\[]?(\w+)', re.IGNORECASE)
+
+# Seconds spent in each loader stage during the last load, per table and
+# for the whole database, plus per-table row counts. Read by
+# benchmark_loader.py; parse/convert times are summed over worker processes.
+LOAD_STATS = {'tables': {}, 'stages': {}}
+
+def reset_stats():
+    """Clear LOAD_STATS before a new load"""
+    LOAD_STATS['tables'].clear()
+    LOAD_STATS['stages'].clear()
+
+def add_stat(stage, value, table=None):
+    """Add a duration (or count) to a stage in LOAD_STATS"""
+    target = LOAD_STATS['tables'].setdefault(table, {}) if table else LOAD_STATS['stages']
+    target[stage] = target.get(stage, 0) + value
+
+def timed(iterable, stage, table=None):
+    """Yield from an iterable, adding the time spent producing each item to a stage"""
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            add_stat(stage, time.perf_counter() - start, table)
+            return
+        add_stat(stage, time.perf_counter() - start, table)
+        yield item
+
+def default_workers():
+    """Number of parser processes to use: one per core, leaving one for the writer"""
+    return max(0, (os.cpu_count() or 1) - 1)
+
+def create_database(bulk=True, batch_size=BATCH_SIZE, workers=None, incremental=False,
+                    compact=False):
     """Create the database and load all CSV data"""
-    # Connect to SQLite database (creates it if it doesn't exist)
-    conn = sqlite3.connect('ecommerce.db')
+    reset_stats()
+    if incremental:
+        return update_database(batch_size)
+
+    if not bulk:
+        # The original loader parsed in the writing process
+        workers = 0
+    elif workers is None:
+        workers = default_workers()
+    # Start the parser workers before opening the database so that no
+    # SQLite handle is inherited by the forked processes
+    pool = Pool(workers) if workers > 0 else None
+
+    # Build a brand-new database file next to the live one
+    remove_database(BUILD_DATABASE)
+    conn = sqlite3.connect(BUILD_DATABASE)
     cursor = conn.cursor()
-    
-    # Read and execute the schema
-    with open('database_schema.sql', 'r') as f:
-        schema = f.read()
-        cursor.executescript(schema)
-    
-    print("Database schema created successfully!")
-    
-    # Load data from CSV files
-    load_distribution_centers(cursor)
-    load_users(cursor)
-    load_products(cursor)
-    load_orders(cursor)
-    load_inventory_items(cursor)
-    load_order_items(cursor)
-    
+
+    # Read and execute the schema. Secondary indexes are built after the
+    # data is in, instead of being updated on every insert.
+    stage_start = time.perf_counter()
+    with open(SCHEMA_FILE, 'r') as f:
+        table_statements, index_statements = split_schema(f.read())
+    index_statements += LOADER_INDEXES
+    cursor.executescript(';\n'.join(table_statements) + ';')
+    add_missing_columns(conn)
+    cursor.executescript(LOAD_STATE_SCHEMA)
+    cursor.execute('DELETE FROM load_state')
+    conn.commit()
+    add_stat('schema', time.perf_counter() - stage_start)
+
+    print(f"Database schema created successfully! ({len(index_statements)} indexes deferred)")
+
+    if bulk:
+        apply_pragmas(conn, BULK_PRAGMAS)
+        print(f"Bulk mode: {batch_size} rows per batch")
+    else:
+        batch_size = None
+        print("Row-by-row mode: one execute call per row, default PRAGMAs, no parser workers")
+    if pool:
+        print(f"Parsing with {workers} worker processes")
+
+    # Load data from CSV files (parents before children). Workers only
+    # parse and convert; this process is the single writer.
+    start = time.perf_counter()
+    try:
+        for table in TABLES:
+            stat = os.stat(table['csv'])
+            load_table(cursor, table, batch_size, pool, workers)
+            record_load_state(conn, table, stat)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    if compact:
+        stage_start = time.perf_counter()
+        compact_database(conn)
+        add_stat('compact', time.perf_counter() - stage_start)
+    build_indexes(conn, index_statements)
+    build_search_index(conn)
+    build_summaries(conn)
+    write_generation(conn)
+
     # Commit changes and close connection
+    stage_start = time.perf_counter()
     conn.commit()
+    add_stat('commit', time.perf_counter() - stage_start)
+    if compact:
+        # Reclaim the pages of the dropped wide tables
+        stage_start = time.perf_counter()
+        conn.execute('VACUUM')
+        add_stat('vacuum', time.perf_counter() - stage_start)
+        print(f"Compact database size: {os.path.getsize(BUILD_DATABASE) / (1024 * 1024):.1f} MB")
     conn.close()
-    print("All data loaded successfully!")
+    print(f"All data loaded successfully in {time.perf_counter() - start:.1f}s!")
+    add_stat('load', time.perf_counter() - start)
+    return publish_database()
+
+def update_database(batch_size=BATCH_SIZE):
+    """Load only new or changed CSV rows into a copy of the live database"""
+    resumed = open_build_copy()
+    conn = sqlite3.connect(BUILD_DATABASE)
+    apply_pragmas(conn, INCREMENTAL_PRAGMAS)
+    if not resumed:
+        set_metadata(conn, INCREMENTAL_BUILD_KEY, 'in progress')
+        conn.commit()
+    if get_metadata(conn, 'layout') == 'compact':
+        conn.close()
+        remove_database(BUILD_DATABASE)
+        print("❌ Incremental loads are not supported for the compact layout, run a full load with --compact")
+        return False
+
+    # Create the tables only if this is a brand-new database. Indexes are
+    # (re)built at the end, which is a no-op for the ones that exist.
+    with open(SCHEMA_FILE, 'r') as f:
+        table_statements, index_statements = split_schema(f.read())
+    index_statements += LOADER_INDEXES
+    created = not conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='products'").fetchone()
+    if created:
+        conn.executescript(';\n'.join(table_statements) + ';')
+        print(f"Database schema created successfully! ({len(index_statements)} indexes deferred)")
+    added = add_missing_columns(conn)
+    conn.commit()
+    conn.executescript(LOAD_STATE_SCHEMA)
+    print(f"Incremental mode: committing every {batch_size} rows")
+
+    start = time.perf_counter()
+    written = 0
+    for table in TABLES:
+        written += load_table_incremental(conn, table, batch_size)
+
+    if not (written or created or resumed or added):
+        conn.close()
+        remove_database(BUILD_DATABASE)
+        print(f"Nothing new to load, {DATABASE} is up to date")
+        return True
+
+    build_indexes(conn, index_statements)
+    build_search_index(conn)
+    build_summaries(conn)
+    write_generation(conn)
+    # Finished: a build that then fails verification is not resumed
+    conn.execute("DELETE FROM load_metadata WHERE key = ?", (INCREMENTAL_BUILD_KEY,))
+    conn.commit()
+    conn.close()
+    print(f"Incremental load finished in {time.perf_counter() - start:.1f}s!")
+    add_stat('load', time.perf_counter() - start)
+    return publish_database()
+
+def open_build_copy():
+    """Prepare BUILD_DATABASE as a copy of the live database for an incremental load
+
+    A build left behind by an interrupted incremental load is reused so the
+    load can resume from its last committed batch. Returns True in that
+    case. Anything else left in BUILD_DATABASE (an interrupted full load,
+    which has no rollback journal, or a build that failed verification) is
+    discarded and the live database copied afresh.
+    """
+    if os.path.exists(BUILD_DATABASE):
+        conn = sqlite3.connect(BUILD_DATABASE)
+        try:
+            resumable = (get_metadata(conn, INCREMENTAL_BUILD_KEY) == 'in progress'
+                         and conn.execute('PRAGMA quick_check').fetchone()[0] == 'ok')
+        except sqlite3.DatabaseError:
+            resumable = False
+        conn.close()
+        if resumable:
+            print(f"Resuming interrupted load in {BUILD_DATABASE}")
+            return True
+        print(f"Discarding the unfinished build in {BUILD_DATABASE}")
+        remove_database(BUILD_DATABASE)
+
+    if os.path.exists(DATABASE):
+        # The backup API takes a consistent snapshot even while the API
+        # is reading the live file
+        source = sqlite3.connect(DATABASE)
+        target = sqlite3.connect(BUILD_DATABASE)
+        source.backup(target)
+        target.close()
+        source.close()
+    return False
+
+def remove_database(path):
+    """Delete a database file and any rollback journal next to it"""
+    for name in (path, path + '-journal'):
+        if os.path.exists(name):
+            os.remove(name)
+
+def get_metadata(conn, key):
+    """Read a value from load_metadata, or None"""
+    try:
+        row = conn.execute("SELECT value FROM load_metadata WHERE key = ?", (key,)).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+def set_metadata(conn, key, value):
+    """Write a value to load_metadata"""
+    conn.execute(LOAD_METADATA_SCHEMA)
+    conn.execute("INSERT OR REPLACE INTO load_metadata (key, value) VALUES (?, ?)", (key, value))
+
+def write_generation(conn):
+    """Stamp the database with a new data generation id"""
+    generation = datetime.now().strftime('%Y%m%dT%H%M%S.%f')
+    set_metadata(conn, 'generation', generation)
+    set_metadata(conn, 'loaded_at', datetime.now().isoformat())
+    return generation
+
+def fsync_path(path):
+    """Flush a file, or the entries of a directory, to disk"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def publish_database():
+    """Verify the freshly built database and atomically move it into place
+
+    The build is written with synchronous=OFF, so its pages may still be
+    only in the OS cache. It is flushed before the rename, and the directory
+    after it, so a power loss cannot leave the rename on disk without the
+    data it points to.
+    """
+    print()
+    start = time.perf_counter()
+    verified = verify_database_setup(BUILD_DATABASE)
+    add_stat('verify', time.perf_counter() - start)
+    if not verified:
+        print(f"\n❌ Verification failed: {DATABASE} was left unchanged, "
+              f"the rejected build is in {BUILD_DATABASE}")
+        return False
+    fsync_path(BUILD_DATABASE)
+    try:
+        # os.replace is an atomic rename: readers see either the old file
+        # or the new one, never a mix
+        os.replace(BUILD_DATABASE, DATABASE)
+    except PermissionError as e:
+        # Windows refuses to replace a file another process has open
+        print(f"\n❌ Could not replace {DATABASE}: {e}. The new build is in {BUILD_DATABASE}")
+        return False
+    try:
+        fsync_path(os.path.dirname(os.path.abspath(DATABASE)))
+    except OSError:
+        # Windows cannot open a directory; NTFS journals the rename itself
+        pass
+    print(f"\n✅ Published new data generation to {DATABASE}")
+    return True
+
+def split_schema(schema):
+    """Split a schema script into (table_statements, index_statements)
+
+    Index statements are rewritten with IF NOT EXISTS so they can be
+    replayed against a database that already has some of them.
+    """
+    table_statements = []
+    index_statements = []
+    statement = ''
+    for line in schema.splitlines(keepends=True):
+        statement += line
+        if not sqlite3.complete_statement(statement):
+            continue
+        statement = statement.strip().rstrip(';')
+        match = INDEX_STATEMENT.match(statement)
+        if match:
+            unique = 'UNIQUE ' if match.group(1) else ''
+            index_statements.append(f"CREATE {unique}INDEX IF NOT EXISTS {statement[match.end():]}")
+        else:
+            table_statements.append(statement)
+        statement = ''
+    if statement.strip():
+        table_statements.append(statement.strip())
+    return table_statements, index_statements
+
+def build_indexes(conn, index_statements):
+    """Build the deferred indexes in one pass and refresh planner statistics"""
+    existing = count_indexes(conn)
+    views = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='view'")}
+    start = time.perf_counter()
+    for statement in index_statements:
+        # Tables replaced by views in the compact layout have their own indexes
+        match = INDEX_TARGET.search(statement)
+        if match and match.group(1) in views:
+            continue
+        conn.execute(statement)
+    built = count_indexes(conn) - existing
+    index_time = time.perf_counter() - start
+    add_stat('index', index_time)
+    if built:
+        print(f"Built {built} indexes in {index_time:.2f}s")
+
+    # A full ANALYZE after a bulk load; otherwise only re-analyze tables
+    # whose statistics SQLite considers stale
+    start = time.perf_counter()
+    conn.execute('ANALYZE' if built else 'PRAGMA optimize')
+    analyze_time = time.perf_counter() - start
+    add_stat('analyze', analyze_time)
+    print(f"Planner statistics updated in {analyze_time:.2f}s")
+    return index_time, analyze_time
+
+def build_search_index(conn):
+    """(Re)build the products_fts full-text index from the products table"""
+    start = time.perf_counter()
+    conn.executescript(SEARCH_INDEX_SCHEMA)
+    conn.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+    # Relevance ranking weighs name matches over brand over category
+    conn.execute("INSERT INTO products_fts (products_fts, rank) VALUES ('rank', 'bm25(10.0, 5.0, 2.0)')")
+    conn.execute("INSERT INTO products_fts (products_fts) VALUES ('optimize')")
+    elapsed = time.perf_counter() - start
+    add_stat('search_index', elapsed)
+    print(f"Product search index built in {elapsed:.2f}s")
+
+def build_summaries(conn):
+    """Recompute the product summary tables from the loaded products"""
+    start = time.perf_counter()
+    conn.executescript(SUMMARY_SCHEMA)
+    # The same grouping the endpoints fall back to, numbered in its order
+    compact = get_metadata(conn, 'layout') == 'compact'
+    for column in GROUP_AGGREGATES:
+        conn.execute(f"""
+            INSERT INTO {column}_summary
+            SELECT ROW_NUMBER() OVER (ORDER BY count DESC, {column}), *
+            FROM ({group_query(column, compact)})
+        """)
+    elapsed = time.perf_counter() - start
+    add_stat('summaries', elapsed)
+    print(f"Product summary tables refreshed in {elapsed:.2f}s")
+
+def count_indexes(conn):
+    """Number of user-defined indexes in the database"""
+    return conn.execute(
+        "SELECT COUNT(*) FROM sqlite_master WHERE type='index' AND sql IS NOT NULL"
+    ).fetchone()[0]
+
+def add_missing_columns(conn):
+    """Add loader-derived columns (such as the epoch timestamps) the tables don't have yet
+
+    Rows already in the table are backfilled from their source column.
+    Returns the number of columns added.
+    """
+    added = 0
+    for table in TABLES:
+        existing = table_columns(conn, table['name'])
+        for name, kind, *source in table['columns']:
+            if name in existing:
+                continue
+            conn.execute(f"ALTER TABLE {table['name']} ADD COLUMN {name} {COLUMN_TYPES[kind]}")
+            if kind == EPOCH:
+                conn.execute(f"""
+                    UPDATE {table['name']}
+                    SET {name} = CAST(strftime('%s', REPLACE({source[0]}, ' UTC', '')) AS INTEGER)
+                    WHERE {source[0]} IS NOT NULL
+                """)
+            added += 1
+    return added
+
+def compact_database(conn):
+    """Rewrite products and inventory_items into the compact layout"""
+    start = time.perf_counter()
+    product_columns = [row[1] for row in conn.execute("PRAGMA table_info(products)")]
+
+    # inventory_items can only drop its copies of the product columns if
+    # they really are copies
+    derived = {column: column[len('product_'):] for column in table_columns(conn, 'inventory_items')
+               if column.startswith('product_') and column[len('product_'):] in product_columns
+               and column != 'product_id'}
+    mismatched = conn.execute(f"""
+        SELECT COUNT(*) FROM inventory_items i LEFT JOIN products p ON p.id = i.product_id
+        WHERE ({', '.join(f'i.{column}' for column in derived)})
+              IS NOT ({', '.join(f'p.{column}' for column in derived.values())})
+    """).fetchone()[0]
+
+    # The id is the rowid, so SQLite drops the view's join to a lookup table
+    # when a query uses none of its columns; the unique name index serves
+    # filters like category = ?
+    for lookup, column in LOOKUP_TABLES:
+        conn.execute(f"CREATE TABLE {lookup} (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)")
+        conn.execute(f"""
+            INSERT INTO {lookup} (name, id)
+            SELECT {column}, ROW_NUMBER() OVER (ORDER BY {column})
+            FROM products WHERE {column} IS NOT NULL GROUP BY {column}
+        """)
+
+    encoded = dict((column, lookup) for lookup, column in LOOKUP_TABLES)
+    definitions = []
+    for _, name, type_, notnull, _, pk in conn.execute("PRAGMA table_info(products)").fetchall():
+        if name in encoded:
+            definitions.append(f"{name}_id INTEGER REFERENCES {encoded[name]}(id)")
+        else:
+            definitions.append(f"{name} {type_}{' PRIMARY KEY' if pk else ''}{' NOT NULL' if notnull else ''}")
+    conn.execute(f"CREATE TABLE product_rows ({', '.join(definitions)})")
+    conn.execute(f"""
+        INSERT INTO product_rows
+        SELECT {', '.join(f'{encoded[c]}.id' if c in encoded else f'p.{c}' for c in product_columns)}
+        FROM products p
+        {' '.join(f'LEFT JOIN {lookup} ON {lookup}.name = p.{column}' for lookup, column in LOOKUP_TABLES)}
+    """)
+    conn.execute("DROP TABLE products")
+    conn.execute(f"""
+        CREATE VIEW products AS
+        SELECT {', '.join(f'{encoded[c]}.name AS {c}' if c in encoded else f'p.{c}' for c in product_columns)}
+        FROM product_rows p
+        {' '.join(f'LEFT JOIN {lookup} ON {lookup}.id = p.{column}_id' for lookup, column in LOOKUP_TABLES)}
+    """)
+    for _, column in LOOKUP_TABLES:
+        conn.execute(f"CREATE INDEX idx_product_rows_{column}_id ON product_rows({column}_id)")
+
+    if mismatched:
+        print(f"  inventory_items kept as is: {mismatched} rows differ from their product")
+    else:
+        inventory_columns = table_columns(conn, 'inventory_items')
+        kept = [column for column in inventory_columns if column not in derived]
+        definitions = [
+            f"{name} {type_}{' PRIMARY KEY' if pk else ''}{' NOT NULL' if notnull else ''}"
+            for _, name, type_, notnull, _, pk in conn.execute("PRAGMA table_info(inventory_items)").fetchall()
+            if name in kept
+        ]
+        conn.execute(f"CREATE TABLE inventory_item_rows ({', '.join(definitions)})")
+        conn.execute(f"INSERT INTO inventory_item_rows SELECT {', '.join(kept)} FROM inventory_items")
+        conn.execute("DROP TABLE inventory_items")
+        conn.execute(f"""
+            CREATE VIEW inventory_items AS
+            SELECT {', '.join(f'p.{derived[c]} AS {c}' if c in derived else f'i.{c}' for c in inventory_columns)}
+            FROM inventory_item_rows i
+            LEFT JOIN products p ON p.id = i.product_id
+        """)
+        conn.execute("CREATE INDEX idx_inventory_item_rows_product_id ON inventory_item_rows(product_id)")
+        if 'created_at_epoch' in kept:
+            conn.execute("CREATE INDEX idx_inventory_item_rows_created_at_epoch ON inventory_item_rows(created_at_epoch)")
+
+    set_metadata(conn, 'layout', 'compact')
+    print(f"Compact layout built in {time.perf_counter() - start:.2f}s")
+
+def table_columns(conn, table):
+    """Column names of a table or view"""
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+def apply_pragmas(conn, pragmas):
+    """Apply a list of (name, value) PRAGMA settings"""
+    for name, value in pragmas:
+        conn.execute(f'PRAGMA {name} = {value}')
+
+def batched(rows, size):
+    """Yield lists of up to `size` items from an iterable"""
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+def read_chunks(path, chunk_lines=CHUNK_LINES, offset=0, hasher=None):
+    """Split a CSV file into chunks of complete records
+
+    Yields (header, text, end_offset) tuples, where end_offset is the byte
+    position just after the chunk. Reading starts at `offset` (0 for the
+    whole file) and every byte read is fed to `hasher` if one is given.
+    """
+    with open(path, 'rb') as file:
+        header_line = file.readline()
+        header = next(csv.reader([header_line.decode('utf-8')]))
+        if offset:
+            file.seek(offset)
+        else:
+            offset = len(header_line)
+            if hasher:
+                hasher.update(header_line)
+
+        chunk = []
+        record = b''
+        for line in file:
+            offset += len(line)
+            if hasher:
+                hasher.update(line)
+            record += line
+            # An odd number of quotes means a quoted field continues on
+            # the next line, so keep the record together
+            if record.count(b'"') % 2:
+                continue
+            chunk.append(record)
+            record = b''
+            if len(chunk) >= chunk_lines:
+                yield header, b''.join(chunk).decode('utf-8'), offset
+                chunk = []
+        if record:
+            chunk.append(record)
+        if chunk:
+            yield header, b''.join(chunk).decode('utf-8'), offset
+
+def column_names(table):
+    """Names of a table's loaded columns, in insert order"""
+    return [name for name, *_ in table['columns']]
+
+def column_sources(table):
+    """CSV column each loaded column is converted from (usually the same name)"""
+    return [source[0] if source else name for name, _, *source in table['columns']]
+
+def to_epoch(value):
+    """Convert a CSV timestamp such as '2022-03-28 07:18:00+00:00' to Unix seconds"""
+    if not value:
+        return None
+    if value.endswith(' UTC'):
+        value = value[:-4]
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp())
+
+# Compiled converters per (table, CSV header), cached for each process
+_converters = {}
+
+def compile_converter(table, header):
+    """Compile a table's column spec into a converter for csv.reader rows
+
+    Returns (convert, column_converters, positions): `convert` maps a row
+    of CSV fields straight to an insert tuple, the per-column converters
+    are only used to explain why a row was rejected.
+    """
+    cache_key = (table['name'], tuple(header))
+    if cache_key in _converters:
+        return _converters[cache_key]
+
+    index = {name: i for i, name in enumerate(header)}
+    sources = column_sources(table)
+    missing = [name for name in sources if name not in index]
+    if missing:
+        raise ValueError(f"{table['csv']} is missing columns: {', '.join(missing)}")
+
+    positions = [index[name] for name in sources]
+    expressions = [CONVERSIONS[kind].format(f'row[{position}]')
+                   for (_, kind, *_), position in zip(table['columns'], positions)]
+    namespace = {'to_epoch': to_epoch}
+    convert = eval(f"lambda row: ({', '.join(expressions)},)", namespace)
+    column_converters = [eval(f"lambda row: {expression}", namespace) for expression in expressions]
+
+    _converters[cache_key] = convert, column_converters, positions
+    return _converters[cache_key]
+
+def parse_chunk(task):
+    """Parse and convert one chunk of CSV records (runs in the worker processes)
+
+    Returns (rows, rejected, timings) where rejected is a list of
+    (reason, fields) and timings has the parse and convert seconds.
+    """
+    name, header, text = task
+    table = TABLES_BY_NAME[name]
+    convert, column_converters, positions = compile_converter(table, header)
+    width = len(header)
+
+    start = time.perf_counter()
+    records = list(csv.reader(io.StringIO(text)))
+    parsed = time.perf_counter()
+
+    rows = []
+    rejected = []
+    for row in records:
+        try:
+            if len(row) != width:
+                raise IndexError
+            rows.append(convert(row))
+        except Exception:
+            rejected.append(rejection(table, header, row, column_converters, positions))
+    timings = {'parse': parsed - start, 'convert': time.perf_counter() - parsed}
+    return rows, rejected, timings
+
+def collect_chunk(table, result, quarantine):
+    """Record a parsed chunk's rejects and timings, and return its rows"""
+    rows, rejected, timings = result
+    quarantine.extend(rejected)
+    for stage, seconds in timings.items():
+        add_stat(stage, seconds, table['name'])
+    add_stat('rejected', len(rejected), table['name'])
+    return rows
+
+def rejection(table, header, row, column_converters, positions):
+    """Work out why a CSV row could not be converted"""
+    if len(row) != len(header):
+        return f"expected {len(header)} fields, got {len(row)}", row
+    fields = [row[position] for position in positions]
+    for name, column_converter in zip(column_names(table), column_converters):
+        try:
+            column_converter(row)
+        except Exception as e:
+            return f"{name}: {e}", fields
+    return "unknown conversion error", fields
+
+class Quarantine:
+    """Rejected rows of one table, written to quarantine/<table>.csv"""
+
+    def __init__(self, table, append=False):
+        self.table = table
+        self.path = os.path.join(QUARANTINE_DIR, f"{table['name']}.csv")
+        self.append = append
+        self.count = 0
+        self.file = None
+        self.writer = None
+        if not append and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def add(self, reason, fields):
+        """Record one rejected row"""
+        if self.writer is None:
+            os.makedirs(QUARANTINE_DIR, exist_ok=True)
+            is_new = not os.path.exists(self.path)
+            self.file = open(self.path, 'a' if self.append else 'w', encoding='utf-8', newline='')
+            self.writer = csv.writer(self.file)
+            if is_new or not self.append:
+                self.writer.writerow(['reason'] + column_names(self.table))
+        self.writer.writerow([reason] + list(fields))
+        self.count += 1
+
+    def extend(self, rejected):
+        """Record (reason, fields) pairs returned by parse_chunk"""
+        for reason, fields in rejected:
+            self.add(reason, fields)
+
+    def close(self):
+        """Close the file and report how many rows were rejected"""
+        if self.file:
+            self.file.close()
+            self.file = self.writer = None
+        if self.count:
+            print(f"  {self.count} {self.table['label']} rejected, see {self.path}")
+
+def read_rows(table, quarantine):
+    """Read a table's CSV file and yield converted insert tuples"""
+    for header, text, _ in timed(read_chunks(table['csv']), 'read', table['name']):
+        yield from collect_chunk(table, parse_chunk((table['name'], header, text)), quarantine)
+
+def read_rows_parallel(pool, table, workers, quarantine):
+    """Parse a table's CSV file in worker processes and yield converted rows in file order"""
+    # Keep a bounded number of chunks in flight so a slow writer doesn't
+    # let parsed rows pile up in memory
+    max_pending = 2 * workers
+    pending = deque()
+
+    def finish(result):
+        # Time the writer spends waiting for the workers
+        start = time.perf_counter()
+        parsed = result.get()
+        add_stat('wait', time.perf_counter() - start, table['name'])
+        return collect_chunk(table, parsed, quarantine)
+
+    for header, text, _ in timed(read_chunks(table['csv']), 'read', table['name']):
+        pending.append(pool.apply_async(parse_chunk, ((table['name'], header, text),)))
+        if len(pending) >= max_pending:
+            yield from finish(pending.popleft())
+    while pending:
+        yield from finish(pending.popleft())
+
+def insert_batch(cursor, insert_sql, batch, quarantine):
+    """Insert a batch with executemany, falling back to single rows on error"""
+    cursor.execute('SAVEPOINT batch')
+    try:
+        cursor.executemany(insert_sql, batch)
+        cursor.execute('RELEASE batch')
+        return len(batch)
+    except sqlite3.Error:
+        # Undo the partial batch and retry it row by row so that one bad
+        # record doesn't drop the whole batch
+        cursor.execute('ROLLBACK TO batch')
 
-def load_distribution_centers(cursor):
-    """Load distribution centers data"""
-    print("Loading distribution centers...")
-    count = 0
-    with open('archive/distribution_centers.csv', 'r', encoding='utf-8') as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            try:
-                cursor.execute('''
-                    INSERT INTO distribution_centers (id, name, latitude, longitude)
-                    VALUES (?, ?, ?, ?)
-                ''', (
-                    int(row['id']),
-                    row['name'],
-                    float(row['latitude']) if row['latitude'] else None,
-                    float(row['longitude']) if row['longitude'] else None
-                ))
-                count += 1
-            except Exception as e:
-                print(f"Error loading distribution center {row['id']}: {e}")
-    print(f"Distribution centers loaded: {count} records")
-
-def load_users(cursor):
-    """Load users data"""
-    print("Loading users...")
-    count = 0
-    with open('archive/users.csv', 'r', encoding='utf-8') as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            try:
-                cursor.execute('''
-                    INSERT INTO users (id, first_name, last_name, email, age, gender, 
-                                     state, street_address, postal_code, city, country, 
-                                     latitude, longitude, traffic_source, created_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    int(row['id']),
-                    row['first_name'],
-                    row['last_name'],
-                    row['email'],
-                    int(row['age']) if row['age'] and row['age'].isdigit() else None,
-                    row['gender'],
-                    row['state'],
-                    row['street_address'],
-                    row['postal_code'],
-                    row['city'],
-                    row['country'],
-                    float(row['latitude']) if row['latitude'] else None,
-                    float(row['longitude']) if row['longitude'] else None,
-                    row['traffic_source'],
-                    row['created_at'] if row['created_at'] else None
-                ))
-                count += 1
-                if count % 1000 == 0:
-                    print(f"  Loaded {count} users...")
-            except Exception as e:
-                print(f"Error loading user {row['id']}: {e}")
-    print(f"Users loaded: {count} records")
-
-def load_products(cursor):
-    """Load products data"""
-    print("Loading products...")
-    count = 0
-    with open('archive/products.csv', 'r', encoding='utf-8') as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            try:
-                cursor.execute('''
-                    INSERT INTO products (id, cost, category, name, brand, retail_price, 
-                                        department, sku, distribution_center_id)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    int(row['id']),
-                    float(row['cost']) if row['cost'] else None,
-                    row['category'],
-                    row['name'],
-                    row['brand'],
-                    float(row['retail_price']) if row['retail_price'] else None,
-                    row['department'],
-                    row['sku'],
-                    int(row['distribution_center_id']) if row['distribution_center_id'] and row['distribution_center_id'].isdigit() else None
-                ))
-                count += 1
-                if count % 1000 == 0:
-                    print(f"  Loaded {count} products...")
-            except Exception as e:
-                print(f"Error loading product {row['id']}: {e}")
-    print(f"Products loaded: {count} records")
-
-def load_orders(cursor):
-    """Load orders data"""
-    print("Loading orders...")
     count = 0
-    with open('archive/orders.csv', 'r', encoding='utf-8') as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            try:
-                # Handle empty or invalid user_id
-                user_id = row['user_id']
-                if user_id and user_id.isdigit():
-                    user_id = int(user_id)
-                else:
-                    user_id = None
-                    
-                cursor.execute('''
-                    INSERT INTO orders (order_id, user_id, status, gender, created_at, 
-                                      returned_at, shipped_at, delivered_at, num_of_item)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    int(row['order_id']),
-                    user_id,
-                    row['status'],
-                    row['gender'],
-                    row['created_at'] if row['created_at'] else None,
-                    row['returned_at'] if row['returned_at'] else None,
-                    row['shipped_at'] if row['shipped_at'] else None,
-                    row['delivered_at'] if row['delivered_at'] else None,
-                    int(row['num_of_item']) if row['num_of_item'] and row['num_of_item'].isdigit() else None
-                ))
-                count += 1
-                if count % 1000 == 0:
-                    print(f"  Loaded {count} orders...")
-            except Exception as e:
-                print(f"Error loading order {row['order_id']}: {e}")
-    print(f"Orders loaded: {count} records")
-
-def load_inventory_items(cursor):
-    """Load inventory items data"""
-    print("Loading inventory items...")
+    for values in batch:
+        try:
+            cursor.execute(insert_sql, values)
+            count += 1
+        except sqlite3.Error as e:
+            quarantine.add(str(e), values)
+    cursor.execute('RELEASE batch')
+    return count
+
+def insert_rows(cursor, insert_sql, rows, quarantine):
+    """Insert rows with one execute call each and no savepoint, as the original loader did"""
     count = 0
-    with open('archive/inventory_items.csv', 'r', encoding='utf-8') as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            try:
-                cursor.execute('''
-                    INSERT INTO inventory_items (id, product_id, created_at, sold_at, cost,
-                                               product_category, product_name, product_brand,
-                                               product_retail_price, product_department,
-                                               product_sku, product_distribution_center_id)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    int(row['id']),
-                    int(row['product_id']) if row['product_id'] and row['product_id'].isdigit() else None,
-                    row['created_at'] if row['created_at'] else None,
-                    row['sold_at'] if row['sold_at'] else None,
-                    float(row['cost']) if row['cost'] else None,
-                    row['product_category'],
-                    row['product_name'],
-                    row['product_brand'],
-                    float(row['product_retail_price']) if row['product_retail_price'] else None,
-                    row['product_department'],
-                    row['product_sku'],
-                    int(row['product_distribution_center_id']) if row['product_distribution_center_id'] and row['product_distribution_center_id'].isdigit() else None
-                ))
-                count += 1
-                if count % 5000 == 0:
-                    print(f"  Loaded {count} inventory items...")
-            except Exception as e:
-                print(f"Error loading inventory item {row['id']}: {e}")
-    print(f"Inventory items loaded: {count} records")
-
-def load_order_items(cursor):
-    """Load order items data"""
-    print("Loading order items...")
+    for values in rows:
+        try:
+            cursor.execute(insert_sql, values)
+            count += 1
+        except sqlite3.Error as e:
+            quarantine.add(str(e), values)
+    return count
+
+def insert_sql(table):
+    """INSERT statement for a table's CSV columns"""
+    columns = column_names(table)
+    return f"""
+        INSERT INTO {table['name']} ({', '.join(columns)})
+        VALUES ({', '.join('?' * len(columns))})
+    """
+
+def upsert_sql(table):
+    """INSERT statement that updates existing rows only when a value changed"""
+    key, *columns = column_names(table)
+    return insert_sql(table) + f"""
+        ON CONFLICT({key}) DO UPDATE SET
+            {', '.join(f'{column} = excluded.{column}' for column in columns)}
+        WHERE ({', '.join(columns)}) IS NOT ({', '.join(f'excluded.{column}' for column in columns)})
+    """
+
+def load_table(cursor, table, batch_size=BATCH_SIZE, pool=None, workers=0):
+    """Load one table from its CSV file and report rows/second
+
+    A batch_size of None inserts row by row (insert_rows); the rows are
+    still gathered in groups of the progress interval for reporting.
+    """
+    print(f"Loading {table['label']}...")
+    sql = insert_sql(table)
+    if not cursor.connection.in_transaction:
+        cursor.execute('BEGIN')
+
+    start = time.perf_counter()
     count = 0
-    with open('archive/order_items.csv', 'r', encoding='utf-8') as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            try:
-                cursor.execute('''
-                    INSERT INTO order_items (id, order_id, user_id, product_id, inventory_item_id,
-                                           status, created_at, shipped_at, delivered_at, returned_at, sale_price)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    int(row['id']),
-                    int(row['order_id']) if row['order_id'] and row['order_id'].isdigit() else None,
-                    int(row['user_id']) if row['user_id'] and row['user_id'].isdigit() else None,
-                    int(row['product_id']) if row['product_id'] and row['product_id'].isdigit() else None,
-                    int(row['inventory_item_id']) if row['inventory_item_id'] and row['inventory_item_id'].isdigit() else None,
-                    row['status'],
-                    row['created_at'] if row['created_at'] else None,
-                    row['shipped_at'] if row['shipped_at'] else None,
-                    row['delivered_at'] if row['delivered_at'] else None,
-                    row['returned_at'] if row['returned_at'] else None,
-                    float(row['sale_price']) if row['sale_price'] else None
-                ))
-                count += 1
-                if count % 5000 == 0:
-                    print(f"  Loaded {count} order items...")
-            except Exception as e:
-                print(f"Error loading order item {row['id']}: {e}")
-    print(f"Order items loaded: {count} records")
+    progress = table['progress']
+    next_progress = progress
+    quarantine = Quarantine(table)
+    if pool:
+        rows = read_rows_parallel(pool, table, workers, quarantine)
+    else:
+        rows = read_rows(table, quarantine)
+    insert = insert_batch if batch_size else insert_rows
+    for batch in batched(rows, batch_size or progress):
+        insert_start = time.perf_counter()
+        count += insert(cursor, sql, batch, quarantine)
+        add_stat('insert', time.perf_counter() - insert_start, table['name'])
+        if count >= next_progress:
+            print(f"  Loaded {count} {table['label']}...")
+            next_progress = (count // progress + 1) * progress
+
+    elapsed = time.perf_counter() - start
+    add_stat('rows', count, table['name'])
+    add_stat('total', elapsed, table['name'])
+    rate = count / elapsed if elapsed > 0 else 0
+    print(f"{table['label'].capitalize()} loaded: {count} records "
+          f"in {elapsed:.2f}s ({rate:,.0f} rows/sec)")
+    quarantine.close()
+    return count
+
+def load_table_incremental(conn, table, batch_size=BATCH_SIZE):
+    """Load the new or changed rows of one table, resuming from its saved load state"""
+    name = table['name']
+    path = table['csv']
+    stat = os.stat(path)
+    state = get_load_state(conn, name)
+
+    # Continue after the part of the file that is already loaded, as long
+    # as that part is byte-for-byte unchanged. Otherwise re-check every row.
+    offset = 0
+    hasher = hashlib.sha1()
+    last_id = None
+    if state:
+        last_id = state['last_id']
+        if (state['file_size'], state['file_mtime'], state['bytes_loaded']) == (stat.st_size, stat.st_mtime, stat.st_size):
+            print(f"{table['label'].capitalize()}: up to date ({state['row_count']} records)")
+            return 0
+        if state['bytes_loaded'] <= stat.st_size:
+            prefix = file_prefix_hasher(path, state['bytes_loaded'])
+            if prefix.hexdigest() == state['prefix_hash']:
+                offset, hasher = state['bytes_loaded'], prefix
+
+    if offset == stat.st_size:
+        print(f"{table['label'].capitalize()}: up to date ({state['row_count']} records)")
+        save_load_state(conn, name, stat, offset, hasher.hexdigest(), last_id, state['row_count'])
+        conn.commit()
+        return 0
+    if offset:
+        print(f"Loading {table['label']} from byte {offset:,}...")
+    elif state:
+        print(f"Loading {table['label']}: {path} changed, checking every row...")
+    else:
+        print(f"Loading {table['label']}...")
+
+    sql = upsert_sql(table)
+    cursor = conn.cursor()
+    start = time.perf_counter()
+    written = 0
+    quarantine = Quarantine(table, append=True)
+    for header, text, end_offset in timed(read_chunks(path, batch_size, offset, hasher), 'read', name):
+        rows = collect_chunk(table, parse_chunk((name, header, text)), quarantine)
+
+        # Each batch is committed together with the load state that
+        # points past it, so a crash resumes after the last full batch
+        insert_start = time.perf_counter()
+        cursor.execute('BEGIN')
+        changes = conn.total_changes
+        insert_batch(cursor, sql, rows, quarantine)
+        written += conn.total_changes - changes
+        if rows:
+            last_id = max(last_id or 0, max(values[0] for values in rows))
+        save_load_state(conn, name, stat, end_offset, hasher.hexdigest(), last_id)
+        commit_start = time.perf_counter()
+        conn.commit()
+        add_stat('insert', commit_start - insert_start, name)
+        add_stat('commit', time.perf_counter() - commit_start, name)
+
+    row_count = conn.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0]
+    save_load_state(conn, name, stat, stat.st_size, hasher.hexdigest(), last_id, row_count)
+    conn.commit()
+    add_stat('rows', written, name)
+    add_stat('total', time.perf_counter() - start, name)
+    print(f"{table['label'].capitalize()}: {written} new or changed records "
+          f"in {time.perf_counter() - start:.2f}s ({row_count} total)")
+    quarantine.close()
+    return written
+
+def file_prefix_hasher(path, length):
+    """Return a sha1 hasher fed with the first `length` bytes of a file"""
+    hasher = hashlib.sha1()
+    with open(path, 'rb') as file:
+        while length > 0:
+            block = file.read(min(length, 1 << 20))
+            if not block:
+                break
+            hasher.update(block)
+            length -= len(block)
+    return hasher
+
+def get_load_state(conn, table_name):
+    """Return the saved load state for a table as a dict, or None"""
+    cursor = conn.execute("""
+        SELECT file_size, file_mtime, bytes_loaded, prefix_hash, last_id, row_count
+        FROM load_state WHERE table_name = ?
+    """, (table_name,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return dict(zip([column[0] for column in cursor.description], row))
+
+def save_load_state(conn, table_name, stat, bytes_loaded, prefix_hash, last_id, row_count=None):
+    """Insert or update the load state for a table"""
+    conn.execute("""
+        INSERT INTO load_state (table_name, file_size, file_mtime, bytes_loaded,
+                                prefix_hash, last_id, row_count, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(table_name) DO UPDATE SET
+            file_size = excluded.file_size,
+            file_mtime = excluded.file_mtime,
+            bytes_loaded = excluded.bytes_loaded,
+            prefix_hash = excluded.prefix_hash,
+            last_id = excluded.last_id,
+            row_count = COALESCE(excluded.row_count, load_state.row_count),
+            updated_at = excluded.updated_at
+    """, (table_name, stat.st_size, stat.st_mtime, bytes_loaded, prefix_hash,
+          last_id, row_count, datetime.now().isoformat()))
+
+def record_load_state(conn, table, stat):
+    """Record the state of a fully loaded table so later incremental loads can skip it"""
+    name = table['name']
+    key = column_names(table)[0]
+    last_id, row_count = conn.execute(f"SELECT MAX({key}), COUNT(*) FROM {name}").fetchone()
+    prefix_hash = file_prefix_hasher(table['csv'], stat.st_size).hexdigest()
+    save_load_state(conn, name, stat, stat.st_size, prefix_hash, last_id, row_count)
+
+# Tables in foreign-key load order, with the columns loaded into each as
+# (column, type) or (column, type, CSV column it is derived from)
+TABLES = [
+    {
+        'name': 'distribution_centers',
+        'label': 'distribution centers',
+        'csv': 'archive/distribution_centers.csv',
+        'columns': [
+            ('id', KEY), ('name', STR), ('latitude', FLOAT), ('longitude', FLOAT),
+        ],
+        'progress': 1000,
+    },
+    {
+        'name': 'users',
+        'label': 'users',
+        'csv': 'archive/users.csv',
+        'columns': [
+            ('id', KEY), ('first_name', STR), ('last_name', STR), ('email', STR),
+            ('age', INT), ('gender', STR), ('state', STR), ('street_address', STR),
+            ('postal_code', STR), ('city', STR), ('country', STR),
+            ('latitude', FLOAT), ('longitude', FLOAT), ('traffic_source', STR),
+            ('created_at', TEXT),
+        ],
+        'progress': 10000,
+    },
+    {
+        'name': 'products',
+        'label': 'products',
+        'csv': 'archive/products.csv',
+        'columns': [
+            ('id', KEY), ('cost', FLOAT), ('category', STR), ('name', STR),
+            ('brand', STR), ('retail_price', FLOAT), ('department', STR),
+            ('sku', STR), ('distribution_center_id', INT),
+        ],
+        'progress': 10000,
+    },
+    {
+        'name': 'orders',
+        'label': 'orders',
+        'csv': 'archive/orders.csv',
+        'columns': [
+            ('order_id', KEY), ('user_id', INT), ('status', STR), ('gender', STR),
+            ('created_at', TEXT), ('returned_at', TEXT), ('shipped_at', TEXT),
+            ('delivered_at', TEXT), ('num_of_item', INT),
+            ('created_at_epoch', EPOCH, 'created_at'),
+            ('returned_at_epoch', EPOCH, 'returned_at'),
+            ('shipped_at_epoch', EPOCH, 'shipped_at'),
+            ('delivered_at_epoch', EPOCH, 'delivered_at'),
+        ],
+        'progress': 10000,
+    },
+    {
+        'name': 'inventory_items',
+        'label': 'inventory items',
+        'csv': 'archive/inventory_items.csv',
+        'columns': [
+            ('id', KEY), ('product_id', INT), ('created_at', TEXT), ('sold_at', TEXT),
+            ('cost', FLOAT), ('product_category', STR), ('product_name', STR),
+            ('product_brand', STR), ('product_retail_price', FLOAT),
+            ('product_department', STR), ('product_sku', STR),
+            ('product_distribution_center_id', INT),
+            ('created_at_epoch', EPOCH, 'created_at'),
+            ('sold_at_epoch', EPOCH, 'sold_at'),
+        ],
+        'progress': 50000,
+    },
+    {
+        'name': 'order_items',
+        'label': 'order items',
+        'csv': 'archive/order_items.csv',
+        'columns': [
+            ('id', KEY), ('order_id', INT), ('user_id', INT), ('product_id', INT),
+            ('inventory_item_id', INT), ('status', STR), ('created_at', TEXT),
+            ('shipped_at', TEXT), ('delivered_at', TEXT), ('returned_at', TEXT),
+            ('sale_price', FLOAT),
+            ('created_at_epoch', EPOCH, 'created_at'),
+            ('shipped_at_epoch', EPOCH, 'shipped_at'),
+            ('delivered_at_epoch', EPOCH, 'delivered_at'),
+            ('returned_at_epoch', EPOCH, 'returned_at'),
+        ],
+        'progress': 50000,
+    },
+]
+
+TABLES_BY_NAME = {table['name']: table for table in TABLES}
 
 def verify_data():
     """Verify that data was loaded correctly"""
-    conn = sqlite3.connect('ecommerce.db')
+    conn = sqlite3.connect(DATABASE)
     cursor = conn.cursor()
     
     print("\n=== Data Verification ===")
@@ -263,5 +1217,28 @@ def verify_data():
     conn.close()
 
 if __name__ == "__main__":
-    create_database()
-    verify_data() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Create ecommerce.db from the archive CSV files')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help=f'rows per executemany batch in bulk mode (default: {BATCH_SIZE})')
+    parser.add_argument('--row-by-row', action='store_true',
+                        help='insert with one execute call per row, default PRAGMAs and no parser workers, '
+                             "like the original loader's inserts (for comparison)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help='CSV parser processes (default: cores - 1; 0 parses in the writer process)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='load only new or changed rows into the existing database, resuming an interrupted load')
+
+    parser.add_argument('--compact', action='store_true',
+                        help='store categorical columns in lookup tables behind views (smaller file, full loads only)')
+    parser.add_argument('--export-columnar', nargs='?', const=SNAPSHOT_DIR, default=None, metavar='DIR',
+                        help=f'also write a columnar snapshot of the large tables after publishing (default DIR: {SNAPSHOT_DIR})')
+    args = parser.parse_args()
+
+    published = create_database(bulk=not args.row_by_row, batch_size=args.batch_size,
+                                workers=args.workers, incremental=args.incremental,
+                                compact=args.compact)
+    if published:
+        verify_data()
+        if args.export_columnar:
+            print(f"\nExporting columnar snapshot to {args.export_columnar}/...")
+            export_snapshot(DATABASE, args.export_columnar) 
\ No newline at end of file
@@ -0,0 +1,161 @@
+"""
+In-process request and SQL metrics for the API, rendered in the Prometheus
+text exposition format.
+
+Latencies go into fixed-bucket histograms, so recording one is a bisect and
+a few integer additions under a lock, cheap enough to leave on. p50/p95/p99
+are estimated from the buckets the same way Prometheus' histogram_quantile
+does and exported as a separate gauge for dashboards that cannot run
+PromQL.
+"""
+
+import threading
+from bisect import bisect_left
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+class Histogram:
+    """Cumulative-bucket histogram of observed values"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimate a quantile by linear interpolation within its bucket"""
+        if not self.count:
+            return float('nan')
+        rank = q * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            if cumulative + count >= rank and count:
+                if index == len(self.buckets):
+                    # Beyond the largest bucket: report its bound
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+def format_labels(labels):
+    """Render a label dict as {name="value",...}"""
+    if not labels:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels.items()
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+def format_value(value):
+    if value != value:
+        return 'NaN'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class Metrics:
+    """Request, response size and SQL statistics for one process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = {}        # (route, method, status) -> count
+        self._latency = {}         # (route, method) -> Histogram
+        self._response_bytes = {}  # (route, method) -> bytes sent
+        self._sql_latency = {}     # query name -> Histogram
+        self._sql_rows = {}        # query name -> rows returned
+
+    def observe_request(self, route, method, status, seconds, response_bytes):
+        """Record one handled request"""
+        with self._lock:
+            key = (route, method, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            key = (route, method)
+            histogram = self._latency.get(key)
+            if histogram is None:
+                histogram = self._latency[key] = Histogram()
+            histogram.observe(seconds)
+            self._response_bytes[key] = self._response_bytes.get(key, 0) + response_bytes
+
+    def observe_query(self, name, seconds, rows):
+        """Record one SQL statement, including fetching its rows"""
+        with self._lock:
+            histogram = self._sql_latency.get(name)
+            if histogram is None:
+                histogram = self._sql_latency[name] = Histogram()
+            histogram.observe(seconds)
+            self._sql_rows[name] = self._sql_rows.get(name, 0) + rows
+
+    def render(self, gauges=()):
+        """Return every metric in the Prometheus text format
+
+        gauges is an iterable of (name, help, type, [(labels, value)]) for
+        values owned elsewhere, such as pool and cache counters.
+        """
+        lines = []
+
+        def family(name, help_text, kind, samples):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for sample_name, labels, value in samples:
+                lines.append(f'{sample_name}{format_labels(labels)} {format_value(value)}')
+
+        def histogram_samples(name, histograms):
+            for labels, histogram in histograms:
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    yield f'{name}_bucket', dict(labels, le=format_value(bound)), cumulative
+                yield f'{name}_bucket', dict(labels, le='+Inf'), histogram.count
+                yield f'{name}_sum', labels, histogram.sum
+                yield f'{name}_count', labels, histogram.count
+
+        def quantile_samples(name, histograms):
+            for labels, histogram in histograms:
+                for q in QUANTILES:
+                    yield name, dict(labels, quantile=format_value(q)), histogram.quantile(q)
+
+        with self._lock:
+            requests = sorted(self._requests.items())
+            latency = [({'route': route, 'method': method}, histogram)
+                       for (route, method), histogram in sorted(self._latency.items())]
+            response_bytes = sorted(self._response_bytes.items())
+            sql_latency = [({'query': name}, histogram)
+                           for name, histogram in sorted(self._sql_latency.items())]
+            sql_rows = sorted(self._sql_rows.items())
+
+            family('api_requests_total', 'Requests handled, by route, method and status.', 'counter',
+                   (('api_requests_total', {'route': route, 'method': method, 'status': status}, count)
+                    for (route, method, status), count in requests))
+            family('api_request_duration_seconds', 'Request latency by route.', 'histogram',
+                   histogram_samples('api_request_duration_seconds', latency))
+            family('api_request_duration_quantile_seconds',
+                   'Request latency quantiles estimated from the histogram buckets.', 'gauge',
+                   quantile_samples('api_request_duration_quantile_seconds', latency))
+            family('api_response_bytes_total', 'Response body bytes sent, by route.', 'counter',
+                   (('api_response_bytes_total', {'route': route, 'method': method}, total)
+                    for (route, method), total in response_bytes))
+            family('api_sql_duration_seconds', 'SQL execution and fetch time by query.', 'histogram',
+                   histogram_samples('api_sql_duration_seconds', sql_latency))
+            family('api_sql_duration_quantile_seconds',
+                   'SQL time quantiles estimated from the histogram buckets.', 'gauge',
+                   quantile_samples('api_sql_duration_quantile_seconds', sql_latency))
+            family('api_sql_rows_total', 'Rows returned by SQL queries, by query.', 'counter',
+                   (('api_sql_rows_total', {'query': name}, rows) for name, rows in sql_rows))
+
+        for name, help_text, kind, samples in gauges:
+            family(name, help_text, kind, ((name, labels, value) for labels, value in samples))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,240 @@
+"""
+SQL for the product listing endpoints.
+
+app.py builds its listing, count and export queries here, and
+verify_setup.py builds the same queries to check their plans, so the
+audit always looks at the SQL the API actually runs.
+"""
+
+import re
+
+# Every product column plus the name of its distribution center
+DEFAULT_SELECT = "p.*, dc.name as distribution_center_name"
+DISTRIBUTION_CENTER_JOIN = "LEFT JOIN distribution_centers dc ON p.distribution_center_id = dc.id"
+
+# Facets a listing can return counts for, and the expression each groups by
+FACET_EXPRESSIONS = {
+    'category': "p.category",
+    'brand': "p.brand",
+    'department': "p.department",
+    # The same ranges as /api/products/stats
+    'price': """CASE
+        WHEN p.retail_price IS NULL THEN NULL
+        WHEN p.retail_price < 25 THEN 'Under $25'
+        WHEN p.retail_price < 50 THEN '$25-$50'
+        WHEN p.retail_price < 100 THEN '$50-$100'
+        WHEN p.retail_price < 200 THEN '$100-$200'
+        ELSE 'Over $200'
+    END""",
+}
+PRICE_RANGES = ('Under $25', '$25-$50', '$50-$100', '$100-$200', 'Over $200')
+# Lower bounds of every range after the first, for bisecting a price into its range
+PRICE_RANGE_BOUNDS = (25, 50, 100, 200)
+
+# In the compact layout (load_data_improved.py --compact) products is a view
+# over product_rows, which stores these columns as <column>_id into lookup
+# tables. SQLite never drops a view's joins from an aggregate query, so
+# counts and groupings read product_rows and look a name up once per filter
+# value or result row instead of joining every lookup for every product.
+LOOKUP_TABLES = {'category': 'categories', 'brand': 'brands', 'department': 'departments'}
+
+# What the category, brand and department endpoints report per value, as
+# (expression, name) pairs
+GROUP_AGGREGATES = {
+    'category': [('COUNT(*)', 'count'), ('AVG(retail_price)', 'avg_price'),
+                 ('MIN(retail_price)', 'min_price'), ('MAX(retail_price)', 'max_price')],
+    'brand': [('COUNT(*)', 'count'), ('AVG(retail_price)', 'avg_price')],
+    'department': [('COUNT(*)', 'count'), ('AVG(retail_price)', 'avg_price')],
+}
+
+def search_match_query(search):
+    """Turn free text into an FTS5 query where every word must match as a prefix"""
+    return ' '.join(f'"{word}"*' for word in re.findall(r'\w+', search))
+
+def lookup_name(column):
+    """The name of a compact-layout product's category, brand or department"""
+    return f"(SELECT name FROM {LOOKUP_TABLES[column]} WHERE id = p.{column}_id)"
+
+def build_product_filter(filters, sort='id', has_search_index=False, compact=False):
+    """Build the FROM and WHERE clauses for a set of product filters
+
+    Returns (from_clause, where_clause, params, order_clause); the clauses
+    refer to products as p. Search uses the products_fts index when
+    has_search_index is true and LIKE otherwise. With compact the clauses
+    read product_rows instead, for counting and grouping the matches of a
+    compact database; they only give access to its stored columns.
+    """
+    # Build the WHERE clause based on filters
+    where_conditions = []
+    params = []
+
+    # Columns are qualified because distribution_centers also has a name
+    for column in ('category', 'brand', 'department'):
+        if filters.get(column):
+            if compact:
+                where_conditions.append(f"p.{column}_id = (SELECT id FROM {LOOKUP_TABLES[column]} WHERE name = ?)")
+            else:
+                where_conditions.append(f"p.{column} = ?")
+            params.append(filters[column])
+
+    if filters.get('min_price') is not None:
+        where_conditions.append("p.retail_price >= ?")
+        params.append(filters['min_price'])
+
+    if filters.get('max_price') is not None:
+        where_conditions.append("p.retail_price <= ?")
+        params.append(filters['max_price'])
+
+    table = "product_rows" if compact else "products"
+    from_clause = f"{table} p"
+    order_clause = "p.id"
+    search = filters.get('search')
+    if search:
+        match_query = search_match_query(search)
+        if match_query and has_search_index:
+            # Prefix search through the full-text index built by the loader
+            if sort == 'relevance':
+                from_clause = f"products_fts JOIN {table} p ON p.id = products_fts.rowid"
+                where_conditions.append("products_fts MATCH ?")
+                order_clause = "products_fts.rank, p.id"
+            else:
+                where_conditions.append("p.id IN (SELECT rowid FROM products_fts WHERE products_fts MATCH ?)")
+            params.append(match_query)
+        elif compact:
+            where_conditions.append(f"(p.name LIKE ? OR {lookup_name('brand')} LIKE ? OR {lookup_name('category')} LIKE ?)")
+            search_term = f"%{search}%"
+            params.extend([search_term, search_term, search_term])
+        else:
+            where_conditions.append("(p.name LIKE ? OR p.brand LIKE ? OR p.category LIKE ?)")
+            search_term = f"%{search}%"
+            params.extend([search_term, search_term, search_term])
+
+    where_clause = " AND ".join(where_conditions) if where_conditions else "1=1"
+    return from_clause, where_clause, params, order_clause
+
+def count_query(from_clause, where_clause):
+    """Number of products matching a filter"""
+    return f"SELECT COUNT(*) as total FROM {from_clause} WHERE {where_clause}"
+
+def page_query(select_list, from_clause, join_clause, where_clause, order_clause):
+    """One page of a filter by offset; takes the filter's params, then LIMIT and OFFSET"""
+    return f"""
+        SELECT {select_list}
+        FROM {from_clause}
+        {join_clause}
+        WHERE {where_clause}
+        ORDER BY {order_clause}
+        LIMIT ? OFFSET ?
+    """
+
+def keyset_query(select_list, from_clause, join_clause, where_clause):
+    """One page of a filter after an id; takes the filter's params, then the id and LIMIT"""
+    return f"""
+        SELECT {select_list}
+        FROM {from_clause}
+        {join_clause}
+        WHERE {where_clause} AND p.id > ?
+        ORDER BY p.id
+        LIMIT ?
+    """
+
+def export_query(select_list, from_clause, join_clause, where_clause):
+    """Every product matching a filter in id order"""
+    return f"""
+        SELECT {select_list}
+        FROM {from_clause}
+        {join_clause}
+        WHERE {where_clause}
+        ORDER BY p.id
+    """
+
+def parse_facets(value):
+    """Return the facet names of a facets= parameter ('all' for every facet)
+
+    Raises ValueError for unknown facets.
+    """
+    requested = [name.strip() for name in value.split(',') if name.strip()]
+    if requested == ['all']:
+        return tuple(FACET_EXPRESSIONS)
+    unknown = [name for name in requested if name not in FACET_EXPRESSIONS]
+    if unknown:
+        raise ValueError(f"Unknown facets: {', '.join(unknown)}")
+    return tuple(dict.fromkeys(requested))
+
+def facet_query(from_clause, where_clause, facets, compact=False):
+    """Number of matching products per combination of the facets' values
+
+    One GROUP BY over the filtered rows; facet_counts adds the combinations
+    up into the count of each facet value. With compact the clauses are
+    build_product_filter's compact ones: the combinations are grouped by
+    lookup id, then added up per facet so that each value's name is looked
+    up once. Those rows carry NULL for the other facets, which facet_counts
+    does not count.
+    """
+    positions = ', '.join(str(position) for position in range(1, len(facets) + 1))
+    if not compact:
+        expressions = ', '.join(FACET_EXPRESSIONS[name] for name in facets)
+        return f"SELECT {expressions}, COUNT(*) FROM {from_clause} WHERE {where_clause} GROUP BY {positions}"
+    groups = ', '.join(f"p.{name}_id AS f{position}" if name in LOOKUP_TABLES
+                       else f"{FACET_EXPRESSIONS[name]} AS f{position}"
+                       for position, name in enumerate(facets))
+    per_facet = []
+    for position, name in enumerate(facets):
+        value = (f"(SELECT name FROM {LOOKUP_TABLES[name]} WHERE id = f{position})" if name in LOOKUP_TABLES
+                 else f"f{position}")
+        columns = ', '.join(value if other == position else 'NULL' for other in range(len(facets)))
+        per_facet.append(f"SELECT {columns}, SUM(products) FROM combinations GROUP BY f{position}")
+    return f"""
+        WITH combinations AS (
+            SELECT {groups}, COUNT(*) AS products FROM {from_clause} WHERE {where_clause} GROUP BY {positions}
+        )
+        {' UNION ALL '.join(per_facet)}
+    """
+
+def group_query(column, compact=False):
+    """GROUP_AGGREGATES per value of category, brand or department, most products first
+
+    In the compact layout product_rows is grouped by the stored id and the
+    lookup table joined once per group.
+    """
+    aggregates = GROUP_AGGREGATES[column]
+    if not compact:
+        return f"""
+            SELECT {column}, {', '.join(f'{expression} as {name}' for expression, name in aggregates)}
+            FROM products
+            WHERE {column} IS NOT NULL
+            GROUP BY {column}
+            ORDER BY count DESC, {column}
+        """
+    return f"""
+        SELECT l.name as {column}, {', '.join(f'g.{name}' for _, name in aggregates)}
+        FROM (
+            SELECT {column}_id, {', '.join(f'{expression} as {name}' for expression, name in aggregates)}
+            FROM product_rows
+            WHERE {column}_id IS NOT NULL
+            GROUP BY {column}_id
+        ) g
+        JOIN {LOOKUP_TABLES[column]} l ON l.id = g.{column}_id
+        ORDER BY g.count DESC, l.name
+    """
+
+def facet_counts(rows, facets):
+    """Turn facet_query rows into {facet: [{'value': ..., 'count': n}]}
+
+    Values are ordered by count (price ranges by price); products without a
+    value for a facet are not counted in it.
+    """
+    totals = {name: {} for name in facets}
+    for row in rows:
+        count = row[-1]
+        for name, value in zip(facets, row):
+            if value is not None:
+                totals[name][value] = totals[name].get(value, 0) + count
+    result = {}
+    for name, counts in totals.items():
+        if name == 'price':
+            ordered = [(value, counts[value]) for value in PRICE_RANGES if value in counts]
+        else:
+            ordered = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+        result[name] = [{'value': value, 'count': count} for value, count in ordered]
+    return result
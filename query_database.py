@@ -112,8 +112,8 @@ def run_sample_queries():
         SELECT o.order_id, u.first_name, u.last_name, o.status, o.num_of_item, o.created_at
         FROM orders o
         LEFT JOIN users u ON o.user_id = u.id
-        WHERE o.created_at IS NOT NULL
-        ORDER BY o.created_at DESC
+        WHERE o.created_at_epoch IS NOT NULL
+        ORDER BY o.created_at_epoch DESC
         LIMIT 5
     ''')
     orders = cursor.fetchall()
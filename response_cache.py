@@ -0,0 +1,91 @@
+"""
+In-process LRU caches for values derived from one data generation.
+
+GenerationCache holds arbitrary values (such as row counts). ResponseCache
+holds serialized API responses together with a strong ETag (a hash of the
+body), so a conditional request can be answered with 304 Not Modified
+without running the query or serializing anything.
+
+Each cache belongs to one data generation: the first lookup with a newer
+generation empties it, which is how a load published by the loader
+invalidates it.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+
+CachedResponse = namedtuple('CachedResponse', ['body', 'etag', 'mimetype'])
+
+class GenerationCache:
+    """Size-bounded LRU of values for a single data generation
+
+    Every value has a size (1 unless given); the cache holds at most
+    max_entries values and max_bytes of total size.
+    """
+
+    def __init__(self, max_entries=128, max_bytes=16 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._generation = None
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def _check_generation(self, generation):
+        if generation != self._generation:
+            if self._entries:
+                self._stats['invalidations'] += 1
+            self._entries.clear()
+            self._bytes = 0
+            self._generation = generation
+
+    def get(self, key, generation):
+        """Return the value cached for key in this generation, or None"""
+        with self._lock:
+            self._check_generation(generation)
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry[0]
+
+    def put(self, key, generation, value, size=1):
+        """Store a value for key in this generation and return it"""
+        if size > self.max_bytes:
+            return value
+        with self._lock:
+            self._check_generation(generation)
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self._stats['evictions'] += 1
+        return value
+
+    def clear(self):
+        """Drop every entry"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Return the cache counters and current size"""
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), bytes=self._bytes,
+                        max_entries=self.max_entries, max_bytes=self.max_bytes)
+
+class ResponseCache(GenerationCache):
+    """LRU of response bodies and their ETags, bounded by total body size"""
+
+    def put(self, key, generation, body, mimetype):
+        """Store a response body and return its CachedResponse"""
+        entry = CachedResponse(body, hashlib.sha1(body).hexdigest(), mimetype)
+        return super().put(key, generation, entry, len(body))
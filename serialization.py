@@ -0,0 +1,49 @@
+"""
+Row and JSON serialization for the API.
+
+Connections return plain tuples; the column names are read once per cursor
+from cursor.description and zipped onto each row, instead of building a
+sqlite3.Row and calling keys() for every row. Payloads are encoded straight
+to bytes with orjson when it is installed, or the standard json module.
+"""
+
+import json
+
+from flask import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_ENCODER = 'orjson' if orjson else 'json'
+
+def column_names(cursor):
+    """Return the column names of a cursor's result"""
+    return [description[0] for description in cursor.description]
+
+def rows_as_dicts(cursor, rows=None):
+    """Return rows (by default the rest of the cursor) as dicts keyed by column name"""
+    columns = column_names(cursor)
+    if rows is None:
+        rows = cursor.fetchall()
+    return [dict(zip(columns, row)) for row in rows]
+
+def row_as_dict(cursor, row):
+    """Return one row of a cursor as a dict, or None"""
+    if row is None:
+        return None
+    return dict(zip(column_names(cursor), row))
+
+if orjson:
+    def dumps(payload):
+        """Encode a payload as UTF-8 JSON bytes"""
+        return orjson.dumps(payload)
+else:
+    def dumps(payload):
+        """Encode a payload as UTF-8 JSON bytes"""
+        return json.dumps(payload, separators=(',', ':')).encode()
+
+def json_response(payload, status=200):
+    """Return a JSON response for a payload"""
+    return Response(dumps(payload), status=status, mimetype='application/json')
@@ -0,0 +1,132 @@
+"""
+Opt-in log of slow SQL statements and the query plans SQLite chose for them.
+
+While a statement runs, a trace callback captures the SQL as SQLite executed
+it (bound parameters expanded inline) and a progress handler counts virtual
+machine steps. When the statement took longer than the threshold, its name,
+SQL, parameters, duration, row count, step count and EXPLAIN QUERY PLAN are
+written as one JSON object per line to a size-rotated log file:
+
+    {"time": "...", "query": "products.list", "duration_ms": 0.347, "rows": 20,
+     "vm_steps": 9000, "sql": "SELECT ... WHERE p.retail_price >= ? ORDER BY p.id LIMIT ? OFFSET ?",
+     "params": [50.0, 20, 780],
+     "expanded_sql": "SELECT ... WHERE p.retail_price >= 50.0 ORDER BY p.id LIMIT 20 OFFSET 780",
+     "plan": ["SCAN p", "SEARCH dc USING INTEGER PRIMARY KEY (rowid=?) LEFT-JOIN"],
+     "full_scan": true, "temp_btree": false}
+
+The hooks are only installed while a watched statement runs, so the log
+costs nothing when it is disabled.
+"""
+
+import json
+import logging
+import threading
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+
+# The progress handler runs once per this many SQLite VM instructions, so
+# vm_steps is counted to the nearest multiple of it
+PROGRESS_INTERVAL = 1000
+
+def explain_query_plan(conn, query, params=()):
+    """Return the EXPLAIN QUERY PLAN of a query as indented detail lines"""
+    rows = conn.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()
+    depth = {0: -1}
+    plan = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        plan.append('  ' * depth[node_id] + detail)
+    return plan
+
+def plan_problems(plan):
+    """Return (full_scan, temp_btree) for a plan from explain_query_plan
+
+    A full scan is a SCAN of a table (not a subquery, a materialized CTE,
+    a constant row or an FTS5 virtual table, whose scans are index lookups);
+    covering-index scans count too, since they still read every entry.
+    """
+    details = [line.strip() for line in plan]
+    materialized = {'SCAN ' + detail.split()[1] for detail in details
+                    if detail.startswith(('MATERIALIZE ', 'CO-ROUTINE '))}
+    full_scan = any(detail.startswith('SCAN ') and 'VIRTUAL TABLE' not in detail
+                    and not detail.startswith(('SCAN (', 'SCAN CONSTANT ROW'))
+                    and detail.split(' USING')[0] not in materialized
+                    for detail in details)
+    temp_btree = any('TEMP B-TREE' in detail for detail in details)
+    return full_scan, temp_btree
+
+def expanded_statement(query, statements):
+    """Pick the traced statement that is query with its parameters filled in
+
+    The trace also sees the statements SQLite runs internally, such as FTS5
+    reading its shadow tables.
+    """
+    prefix = ' '.join(query.split()).split('?')[0]
+    for statement in statements:
+        statement = ' '.join(statement.split())
+        if statement.startswith(prefix):
+            return statement
+    return None
+
+class SlowQueryLog:
+    """Write statements slower than threshold_seconds to a rotating JSON log"""
+
+    def __init__(self, path, threshold_seconds, max_bytes=10 * 1024 * 1024, backup_count=5):
+        self.path = path
+        self.threshold_seconds = threshold_seconds
+        self.logger = logging.getLogger(f'slow_query_log.{path}')
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        if not self.logger.handlers:
+            handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self.logger.addHandler(handler)
+        self._lock = threading.Lock()
+        self._stats = {'logged': 0}
+
+    def start(self, conn):
+        """Install the trace and progress hooks on conn; returns the state for finish()"""
+        state = {'statements': [], 'steps': 0}
+
+        def count_steps():
+            state['steps'] += 1
+            return 0  # never interrupt the statement
+
+        conn.set_trace_callback(state['statements'].append)
+        conn.set_progress_handler(count_steps, PROGRESS_INTERVAL)
+        return state
+
+    def finish(self, conn, state, name, query, params, seconds, rows):
+        """Remove the hooks and log the statement if it was slow"""
+        conn.set_progress_handler(None, 0)
+        conn.set_trace_callback(None)
+        if seconds < self.threshold_seconds:
+            return
+        try:
+            plan = explain_query_plan(conn, query, params)
+        except Exception as e:
+            plan = [f'EXPLAIN QUERY PLAN failed: {e}']
+        full_scan, temp_btree = plan_problems(plan)
+        entry = {
+            'time': datetime.now(timezone.utc).isoformat(),
+            'query': name,
+            'duration_ms': round(seconds * 1000, 3),
+            'rows': rows,
+            'vm_steps': state['steps'] * PROGRESS_INTERVAL,
+            'sql': ' '.join(query.split()),
+            'params': list(params),
+            'expanded_sql': expanded_statement(query, state['statements']),
+            'plan': plan,
+            'full_scan': full_scan,
+            'temp_btree': temp_btree,
+        }
+        self.logger.info(json.dumps(entry, default=str))
+        with self._lock:
+            self._stats['logged'] += 1
+
+    def stats(self):
+        """Return the log's settings and how many statements it has written"""
+        with self._lock:
+            logged = self._stats['logged']
+        return dict(logged=logged, path=self.path,
+                    threshold_ms=round(self.threshold_seconds * 1000, 3))
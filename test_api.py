@@ -1,10 +1,19 @@
 import requests
+import csv
+import itertools
 import json
+import re
+import sqlite3
 import time
 
+from product_queries import build_product_filter
+
 # API base URL
 BASE_URL = "http://localhost:5000/api"
 
+# Database the API serves, for checks that read it directly
+DATABASE = "ecommerce.db"
+
 def test_health_check():
     """Test the health check endpoint"""
     print("🔍 Testing Health Check...")
@@ -195,6 +204,382 @@ def test_product_filters():
         print(f"❌ Error: {e}")
         return False
 
+def test_cursor_pagination():
+    """Test paging through products with after_id and cursor"""
+    print("\n🔍 Testing Cursor Pagination...")
+    try:
+        response = requests.get(f"{BASE_URL}/products?after_id=0&per_page=5")
+        print(f"First Page - Status: {response.status_code}")
+        if response.status_code != 200:
+            return False
+        first = response.json()
+        first_ids = [product['id'] for product in first['products']]
+        print(f"  IDs: {first_ids}, next_cursor: {first['pagination']['next_cursor']}")
+        if first_ids != sorted(first_ids) or not first['pagination']['has_next']:
+            return False
+
+        # Follow the cursor to the next page
+        response = requests.get(f"{BASE_URL}/products?cursor={first['pagination']['next_cursor']}&per_page=5")
+        print(f"Next Page - Status: {response.status_code}")
+        if response.status_code != 200:
+            return False
+        second_ids = [product['id'] for product in response.json()['products']]
+        print(f"  IDs: {second_ids}")
+        if not second_ids or second_ids[0] <= first_ids[-1] or second_ids != sorted(second_ids):
+            return False
+
+        # A malformed cursor or after_id is rejected rather than ignored
+        for query in ('cursor=not-a-cursor', 'after_id=abc', 'after_id=-1'):
+            response = requests.get(f"{BASE_URL}/products?{query}")
+            print(f"Invalid {query} - Status: {response.status_code}")
+            if response.status_code != 400:
+                return False
+        return True
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return False
+
+def test_products_batch():
+    """Test fetching several products by id"""
+    print("\n🔍 Testing Products Batch...")
+    try:
+        response = requests.get(f"{BASE_URL}/products?per_page=3")
+        ids = [product['id'] for product in response.json()['products']]
+        if len(ids) < 3:
+            return False
+
+        # Products come back in the requested order, duplicates once
+        requested = [ids[2], ids[0], 999999, ids[2], ids[1]]
+        response = requests.get(f"{BASE_URL}/products/batch?ids={','.join(str(i) for i in requested)}")
+        print(f"GET Batch - Status: {response.status_code}")
+        if response.status_code != 200:
+            return False
+        data = response.json()
+        returned = [product['id'] for product in data['products']]
+        print(f"  Requested: {requested}, Returned: {returned}, Missing: {data['missing']}")
+        if returned != [ids[2], ids[0], ids[1]] or data['missing'] != [999999]:
+            return False
+
+        response = requests.post(f"{BASE_URL}/products/batch", json={'ids': requested})
+        print(f"POST Batch - Status: {response.status_code}")
+        if response.status_code != 200 or [product['id'] for product in response.json()['products']] != returned:
+            return False
+
+        # Invalid requests are rejected
+        for description, response in [
+            ("non-integer ids", requests.get(f"{BASE_URL}/products/batch?ids=1,abc")),
+            ("no ids", requests.get(f"{BASE_URL}/products/batch")),
+            ("too many ids", requests.post(f"{BASE_URL}/products/batch", json={'ids': list(range(1, 502))})),
+        ]:
+            print(f"  {description} - Status: {response.status_code}")
+            if response.status_code != 400:
+                return False
+        return True
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return False
+
+def test_export_products():
+    """Test exporting products as NDJSON and CSV"""
+    print("\n🔍 Testing Export Products...")
+    try:
+        response = requests.get(f"{BASE_URL}/products?category=Jeans&per_page=1")
+        expected = response.json()['pagination']['total_count']
+
+        response = requests.get(f"{BASE_URL}/products/export?category=Jeans")
+        print(f"NDJSON Export - Status: {response.status_code}")
+        if response.status_code != 200:
+            return False
+        products = [json.loads(line) for line in response.text.splitlines() if line]
+        ids = [product['id'] for product in products]
+        print(f"  Exported {len(products)} of {expected} jeans products")
+        if len(products) != expected or ids != sorted(ids) or any(p['category'] != 'Jeans' for p in products):
+            return False
+
+        response = requests.get(f"{BASE_URL}/products/export?category=Jeans&format=csv&fields=name,retail_price")
+        print(f"CSV Export - Status: {response.status_code}")
+        if response.status_code != 200:
+            return False
+        # Names may hold quoted line breaks, so rows are read with the csv module
+        rows = list(csv.reader(response.text.splitlines(keepends=True)))
+        print(f"  Header: {rows[0]}, Rows: {len(rows) - 1}")
+        if rows[0] != ['id', 'name', 'retail_price'] or len(rows) - 1 != expected:
+            return False
+
+        # An unknown format is rejected
+        response = requests.get(f"{BASE_URL}/products/export?format=xml")
+        print(f"Unknown Format - Status: {response.status_code}")
+        return response.status_code == 400
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return False
+
+def test_metrics():
+    """Test the Prometheus metrics endpoint"""
+    print("\n🔍 Testing Metrics...")
+    try:
+        requests.get(f"{BASE_URL}/products?per_page=1")
+        response = requests.get(f"{BASE_URL}/metrics")
+        print(f"Status Code: {response.status_code}")
+        print(f"Content-Type: {response.headers.get('Content-Type')}")
+        if response.status_code != 200 or not response.headers.get('Content-Type', '').startswith('text/plain'):
+            return False
+
+        # Every family is present, and the listing request above was counted
+        text = response.text
+        for family in ('api_requests_total', 'api_request_duration_seconds_bucket', 'api_response_bytes_total',
+                       'api_sql_duration_seconds_bucket', 'api_sql_rows_total',
+                       'api_db_pool_connections', 'api_cache_entries'):
+            found = family in text
+            print(f"  {family}: {'found' if found else 'missing'}")
+            if not found:
+                return False
+        return 'api_requests_total{route="/api/products",method="GET",status="200"}' in text
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return False
+
+def test_search():
+    """Test full-text search: prefix matching, relevance order and operator characters"""
+    print("\n🔍 Testing Search...")
+    try:
+        product = requests.get(f"{BASE_URL}/products?per_page=1").json()['products'][0]
+        # The product name's longest word, searched whole and by its first letters
+        word = max(re.findall(r'[^\W\d_]+', product['name']), key=len).lower()
+        prefix = word[:3]
+
+        # Every word must match the start of a word in name, brand or category
+        full = requests.get(f"{BASE_URL}/products?search={word}&per_page=100").json()
+        partial = requests.get(f"{BASE_URL}/products?search={prefix}&per_page=100").json()
+        print(f"Search '{word}': {full['pagination']['total_count']}, "
+              f"prefix '{prefix}': {partial['pagination']['total_count']} products")
+        if partial['pagination']['total_count'] < full['pagination']['total_count'] or not partial['products']:
+            return False
+        for item in partial['products']:
+            text = ' '.join(str(item[key] or '') for key in ('name', 'brand', 'category')).lower()
+            if not any(token.startswith(prefix) for token in re.findall(r'[^\W_]+', text)):
+                print(f"  Product {item['id']} does not match '{prefix}'")
+                return False
+
+        # Relevance ranks name matches first and returns the same products
+        response = requests.get(f"{BASE_URL}/products?search={word}&sort=relevance&per_page=100")
+        print(f"Relevance Sort - Status: {response.status_code}")
+        if response.status_code != 200:
+            return False
+        ranked = response.json()
+        if ranked['pagination']['total_count'] != full['pagination']['total_count']:
+            return False
+        if full['pagination']['total_count'] <= 100:
+            if sorted(item['id'] for item in ranked['products']) != [item['id'] for item in full['products']]:
+                return False
+        first_name = ranked['products'][0]['name'].lower()
+        print(f"  Top result: {ranked['products'][0]['name'][:50]}")
+        if not any(token.startswith(word) for token in re.findall(r'[^\W_]+', first_name)):
+            return False
+
+        # FTS5 query syntax in user input is treated as text, never as an error
+        for search in ['"', 'levi"s', f'{prefix}*', f'-{word}', 'NEAR(a b)', f'{word} AND', 'OR', '(', '^', ':', "'"]:
+            response = requests.get(f"{BASE_URL}/products", params={'search': search, 'per_page': 1})
+            print(f"  search={search!r} - Status: {response.status_code}")
+            if response.status_code != 200:
+                return False
+        return True
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return False
+
+def test_search_like_fallback():
+    """Test that search without the products_fts index falls back to LIKE"""
+    print("\n🔍 Testing Search LIKE Fallback...")
+    try:
+        conn = sqlite3.connect(f'file:{DATABASE}?mode=ro', uri=True)
+        product = conn.execute("SELECT name FROM products ORDER BY id LIMIT 1").fetchone()
+        prefix = max(re.findall(r'[^\W\d_]+', product[0]), key=len).lower()[:3]
+
+        def matching_ids(has_search_index):
+            from_clause, where_clause, params, _ = build_product_filter({'search': prefix},
+                                                                        has_search_index=has_search_index)
+            rows = conn.execute(f"SELECT p.id FROM {from_clause} WHERE {where_clause}", params).fetchall()
+            return where_clause, {row[0] for row in rows}
+
+        fts_where, fts_ids = matching_ids(True)
+        like_where, like_ids = matching_ids(False)
+        conn.close()
+        print(f"Full-text: {len(fts_ids)} products, LIKE: {len(like_ids)} products for '{prefix}'")
+        # A word starting with the prefix also contains it, so LIKE finds at least as much
+        return 'LIKE' in like_where and 'LIKE' not in fts_where and fts_ids <= like_ids and bool(fts_ids)
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return False
+
+def test_conditional_requests():
+    """Test ETags on summary endpoints: 304 on If-None-Match, one cache entry per query string"""
+    print("\n🔍 Testing Conditional Requests...")
+    try:
+        response = requests.get(f"{BASE_URL}/products/stats")
+        etag = response.headers.get('ETag')
+        print(f"Status Code: {response.status_code}, ETag: {etag}")
+        if response.status_code != 200 or not etag:
+            return False
+
+        # The stored ETag revalidates the body without sending it again
+        revalidated = requests.get(f"{BASE_URL}/products/stats", headers={'If-None-Match': etag})
+        print(f"Revalidated: {revalidated.status_code}, {len(revalidated.content)} bytes")
+        if revalidated.status_code != 304 or revalidated.content or revalidated.headers.get('ETag') != etag:
+            return False
+
+        # A different query string is cached separately: a miss first, then a hit
+        def cache_stats():
+            return requests.get(f"{BASE_URL}/health").json()['response_cache']
+
+        variant = f"{BASE_URL}/products/stats?variant={time.time()}"
+        before = cache_stats()
+        requests.get(variant)
+        missed = cache_stats()
+        requests.get(variant)
+        hit = cache_stats()
+        print(f"Variant query string: misses {before['misses']} -> {missed['misses']}, "
+              f"hits {missed['hits']} -> {hit['hits']}")
+        return missed['misses'] == before['misses'] + 1 and hit['hits'] == missed['hits'] + 1
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return False
+
+def test_include_total():
+    """Test that include_total=false drops the totals but not the page or has_next"""
+    print("\n🔍 Testing include_total...")
+    try:
+        category = requests.get(f"{BASE_URL}/products/categories").json()['categories'][0]['category']
+        url = f"{BASE_URL}/products"
+        params = {'category': category, 'per_page': 7}
+
+        conn = sqlite3.connect(f'file:{DATABASE}?mode=ro', uri=True)
+        expected = conn.execute("SELECT COUNT(*) FROM products WHERE category = ?", (category,)).fetchone()[0]
+        conn.close()
+
+        # The default response still carries the totals
+        counted = requests.get(url, params=params).json()
+        pagination = counted['pagination']
+        print(f"Default: total_count {pagination.get('total_count')}, total_pages {pagination.get('total_pages')}"
+              f" (expected {expected} products)")
+        if pagination.get('total_count') != expected or pagination.get('total_pages') != (expected + 6) // 7:
+            return False
+
+        # Without them the same page comes back, on the first page and the last
+        for page in (1, pagination['total_pages']):
+            counted = requests.get(url, params=dict(params, page=page)).json()
+            uncounted = requests.get(url, params=dict(params, page=page, include_total='false')).json()
+            keys = set(uncounted['pagination'])
+            print(f"Page {page} without totals: {sorted(keys)}")
+            if keys & {'total_count', 'total_pages'}:
+                return False
+            if (uncounted['products'] != counted['products']
+                    or uncounted['pagination']['has_next'] != counted['pagination']['has_next']):
+                return False
+        return True
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return False
+
+def test_fields_and_compression():
+    """Test fields= selection and gzip compression of large responses"""
+    print("\n🔍 Testing Fields and Compression...")
+    try:
+        # Each item has exactly the requested fields, plus the id
+        response = requests.get(f"{BASE_URL}/products?fields=name,retail_price,distribution_center_name&per_page=5")
+        keys = {tuple(sorted(product)) for product in response.json()['products']}
+        print(f"Status Code: {response.status_code}, keys: {keys}")
+        if response.status_code != 200 or keys != {('distribution_center_name', 'id', 'name', 'retail_price')}:
+            return False
+
+        unknown = requests.get(f"{BASE_URL}/products?fields=name,no_such_field")
+        print(f"Unknown field: {unknown.status_code}")
+        if unknown.status_code != 400:
+            return False
+
+        # A large listing is gzipped for a client that accepts it, and left alone otherwise
+        url = f"{BASE_URL}/products?per_page=100"
+        compressed = requests.get(url, headers={'Accept-Encoding': 'gzip'})
+        plain = requests.get(url, headers={'Accept-Encoding': 'identity'})
+        print(f"gzip: Content-Encoding {compressed.headers.get('Content-Encoding')}, "
+              f"Vary {compressed.headers.get('Vary')}; identity: {plain.headers.get('Content-Encoding')}")
+        return (compressed.headers.get('Content-Encoding') == 'gzip'
+                and 'Accept-Encoding' in compressed.headers.get('Vary', '')
+                and 'Content-Encoding' not in plain.headers
+                and compressed.json() == plain.json())
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return False
+
+def test_facets():
+    """Test that facet counts add up to the filtered total, and unknown facets are rejected"""
+    print("\n🔍 Testing Facets...")
+    try:
+        department = requests.get(f"{BASE_URL}/products/departments").json()['departments'][0]['department']
+        response = requests.get(f"{BASE_URL}/products", params={'department': department, 'min_price': 50,
+                                                               'facets': 'all', 'per_page': 1})
+        data = response.json()
+        total_count = data['pagination']['total_count']
+        print(f"Status Code: {response.status_code}, {department} from $50: {total_count} products")
+        if response.status_code != 200 or not total_count:
+            return False
+
+        # Every product has one value per facet, so each facet's counts add up to the total
+        for name, values in data['facets'].items():
+            counted = sum(value['count'] for value in values)
+            print(f"  {name}: {len(values)} values, {counted} products")
+            if counted != total_count:
+                return False
+        if [value['value'] for value in data['facets']['department']] != [department]:
+            return False
+
+        unknown = requests.get(f"{BASE_URL}/products?facets=brand,no_such_facet")
+        print(f"Unknown facet: {unknown.status_code}")
+        return unknown.status_code == 400
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return False
+
+def test_catalog_engine():
+    """Test that the in-memory catalog answers listings exactly as SQLite does"""
+    print("\n🔍 Testing Catalog Engine...")
+    try:
+        # Run in-process, to answer the same requests with and without the engine
+        import app as api
+        from catalog_engine import CatalogEngine
+
+        engine = CatalogEngine(api.DATABASE, api.get_data_generation)
+        engine.warm()
+        client = api.app.test_client()
+        saved = api.catalog_engine
+
+        def listing(query, catalog_engine):
+            api.catalog_engine = catalog_engine
+            response = client.get('/api/products', query_string=query)
+            return response.status_code, response.get_json()
+
+        category = requests.get(f"{BASE_URL}/products/categories").json()['categories'][0]['category']
+        filters = [{}, {'category': category}, {'department': 'Men'}, {'category': category, 'min_price': 20},
+                   {'department': 'Women', 'min_price': 20.5, 'max_price': 60}, {'category': 'No such category'}]
+        options = [{}, {'page': 3, 'per_page': 7}, {'page': 2, 'include_total': 'false'}, {'sort': 'relevance'},
+                   {'after_id': 100, 'per_page': 5}, {'cursor': api.encode_cursor(250)},
+                   {'facets': 'all'}, {'fields': 'name,retail_price,distribution_center_name'}, {'fields': 'bogus'}]
+        differences = 0
+        try:
+            for query, extra in itertools.product(filters, options):
+                query = dict(query, **extra)
+                if listing(query, engine) != listing(query, None):
+                    differences += 1
+                    print(f"  Different: {query}")
+        finally:
+            api.catalog_engine = saved
+        print(f"Compared {len(filters) * len(options)} listings, {differences} different, "
+              f"engine stats: {engine.stats()}")
+        return differences == 0 and engine.stats()['loads'] == 1 and engine.stats()['fallbacks'] == 0
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return False
+
 def run_all_tests():
     """Run all API tests"""
     print("🚀 Starting Think41 E-commerce API Tests...")
@@ -209,7 +594,18 @@ def run_all_tests():
         ("Get Brands", test_get_brands),
         ("Get Departments", test_get_departments),
         ("Get Product Stats", test_get_stats),
-        ("Product Filters", test_product_filters)
+        ("Product Filters", test_product_filters),
+        ("Cursor Pagination", test_cursor_pagination),
+        ("Products Batch", test_products_batch),
+        ("Export Products", test_export_products),
+        ("Metrics", test_metrics),
+        ("Search", test_search),
+        ("Search LIKE Fallback", test_search_like_fallback),
+        ("Conditional Requests", test_conditional_requests),
+        ("include_total", test_include_total),
+        ("Fields and Compression", test_fields_and_compression),
+        ("Facets", test_facets),
+        ("Catalog Engine", test_catalog_engine)
     ]
     
     passed = 0
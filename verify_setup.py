@@ -1,31 +1,363 @@
+import argparse
+import itertools
+import re
 import sqlite3
 import os
+import time
 
-def verify_database_setup():
-    """Verify that the database is properly set up and contains all expected data"""
+from product_queries import (DEFAULT_SELECT, DISTRIBUTION_CENTER_JOIN, FACET_EXPRESSIONS, build_product_filter,
+                            count_query, export_query, facet_query, keyset_query, page_query)
+from slow_query_log import explain_query_plan, plan_problems
+
+DATABASE = 'ecommerce.db'
+
+# Page size of the audited listing queries (the API default)
+AUDIT_PAGE_SIZE = 20
+
+# Product filters compared for equality; the price filters are a range
+EQUALITY_FILTERS = ('category', 'brand', 'department')
+
+# Each audited query is timed this many times and the fastest run kept
+AUDIT_REPEAT = 3
+
+# audit_shapes flags, with the names they are reported under
+PLAN_PROBLEMS = (('full_scan', 'full scan'), ('temp_btree', 'temp B-tree'),
+                 ('partial_index', 'index serves part of the filter'))
+
+def sample_filter_values(conn):
+    """Return filter values that match real products, for the plan audit"""
+    category, brand, department = conn.execute("""
+        SELECT category, brand, department FROM products
+        GROUP BY category, brand, department
+        ORDER BY COUNT(*) DESC
+        LIMIT 1
+    """).fetchone()
+    # The middle half of the prices
+    priced = conn.execute("SELECT COUNT(*) FROM products WHERE retail_price IS NOT NULL").fetchone()[0]
+    price_at = lambda offset: conn.execute(
+        "SELECT retail_price FROM products WHERE retail_price IS NOT NULL ORDER BY retail_price LIMIT 1 OFFSET ?",
+        (offset,)).fetchone()[0]
+    name = conn.execute("SELECT name FROM products WHERE category = ? AND brand = ? AND department = ? LIMIT 1",
+                        (category, brand, department)).fetchone()[0]
+    words = re.findall(r'\w+', name or '')
+    return {
+        'category': category,
+        'brand': brand,
+        'department': department,
+        'min_price': price_at(priced // 4),
+        'max_price': price_at(priced * 3 // 4),
+        'search': words[0] if words else None,
+    }
+
+def product_query_shapes(conn):
+    """Yield (label, filter_columns, query, params, expected) for every query shape the API runs on products
+
+    Every combination of the category/brand/department filters, a price
+    range and search is built with product_queries, the same code app.py
+    uses, as a count, an offset page, a cursor page, facet counts and an
+    export. expected names the plan problems no index can avoid: unfiltered
+    queries read every product, and relevance ranking and facet grouping
+    sort the matches.
+    """
+    values = sample_filter_values(conn)
+    has_search_index = bool(conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'products_fts'").fetchone())
+    compact = product_storage(conn)[0] == 'product_rows'
+
+    yield ('get by id', (), f"SELECT {DEFAULT_SELECT} FROM products p {DISTRIBUTION_CENTER_JOIN} WHERE p.id = ?",
+           (1,), ())
+    yield ('batch', (), f"SELECT {DEFAULT_SELECT} FROM products p {DISTRIBUTION_CENTER_JOIN} WHERE p.id IN (?, ?, ?)",
+           (1, 2, 3), ())
+
+    for size in range(len(EQUALITY_FILTERS) + 1):
+        for equality in itertools.combinations(EQUALITY_FILTERS, size):
+            for price in (False, True):
+                for search in (False, True):
+                    if search and not values['search']:
+                        continue
+                    filters = {name: values[name] for name in equality}
+                    if price:
+                        filters['min_price'] = values['min_price']
+                        filters['max_price'] = values['max_price']
+                    if search:
+                        filters['search'] = values['search']
+                    columns = equality + (('retail_price',) if price else ())
+                    name = '+'.join(equality + (('price',) if price else ()) + (('search',) if search else ()))
+                    name = name or 'unfiltered'
+                    expected = () if filters else ('full_scan',)
+
+                    # Counts and facets of a compact database read product_rows, as in app.py
+                    count_from, count_where, count_params, _ = build_product_filter(
+                        filters, has_search_index=has_search_index, compact=compact)
+
+                    sorts = ('id', 'relevance') if search and has_search_index else ('id',)
+                    for sort in sorts:
+                        from_clause, where_clause, params, order_clause = build_product_filter(
+                            filters, sort, has_search_index)
+                        if sort == 'relevance':
+                            yield (f'{name} [page, relevance]', columns,
+                                   page_query(DEFAULT_SELECT, from_clause, DISTRIBUTION_CENTER_JOIN,
+                                              where_clause, order_clause),
+                                   params + [AUDIT_PAGE_SIZE, 0], expected + ('temp_btree',))
+                            continue
+                        yield f'{name} [count]', columns, count_query(count_from, count_where), count_params, expected
+                        yield (f'{name} [page]', columns,
+                               page_query(DEFAULT_SELECT, from_clause, DISTRIBUTION_CENTER_JOIN,
+                                          where_clause, order_clause),
+                               params + [AUDIT_PAGE_SIZE, 0], expected)
+                        yield (f'{name} [cursor]', columns,
+                               keyset_query(DEFAULT_SELECT, from_clause, DISTRIBUTION_CENTER_JOIN, where_clause),
+                               params + [0, AUDIT_PAGE_SIZE + 1], expected)
+                        yield (f'{name} [facets]', columns,
+                               facet_query(count_from, count_where, tuple(FACET_EXPRESSIONS), compact),
+                               count_params, expected + ('temp_btree',))
+                        yield (f'{name} [export]', columns,
+                               export_query(DEFAULT_SELECT, from_clause, DISTRIBUTION_CENTER_JOIN, where_clause),
+                               params, expected)
+
+def time_query(conn, query, params):
+    """Return the fastest of AUDIT_REPEAT runs of a query, in seconds"""
+    best = None
+    for _ in range(AUDIT_REPEAT):
+        start = time.perf_counter()
+        conn.execute(query, params).fetchall()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def unindexed_filter_columns(plan, indexes, columns):
+    """Return the filter columns the index a plan searches products with does not constrain
+
+    indexes is product_indexes(); columns are the shape's filter columns as
+    stored. A shape whose index serves only part of its filter checks the
+    rest against every row the index finds.
+    """
+    for line in plan:
+        found = re.search(r'USING (?:COVERING )?INDEX (\S+) \((.*)\)', line)
+        if found and found.group(1) in indexes:
+            constrained = set(re.findall(r'(\w+)[=<>]', found.group(2)))
+            return tuple(column for column in columns if column not in constrained)
+    return ()
+
+def audit_shapes(conn, shapes):
+    """Explain and time every query shape
+
+    Returns a list of dicts with the shape's label, filter columns, query,
+    params, plan, seconds, and full_scan, temp_btree and partial_index
+    flags for the problems that were not expected.
+    """
+    _, stored = product_storage(conn)
+    indexes = product_indexes(conn)
+    results = []
+    for label, columns, query, params, expected in shapes:
+        plan = explain_query_plan(conn, query, params)
+        full_scan, temp_btree = plan_problems(plan)
+        stored_columns = tuple(stored.get(column, column) for column in columns)
+        results.append({
+            'label': label,
+            'columns': columns,
+            'query': query,
+            'params': params,
+            'plan': plan,
+            'full_scan': full_scan and 'full_scan' not in expected,
+            'temp_btree': temp_btree and 'temp_btree' not in expected,
+            'partial_index': bool(unindexed_filter_columns(plan, indexes, stored_columns)),
+            'seconds': time_query(conn, query, params),
+        })
+    return results
+
+def flagged(result):
+    """Whether an audited shape has a problem an index could fix"""
+    return result['full_scan'] or result['temp_btree'] or result['partial_index']
+
+def plan_changes(results, had, lacks):
+    """Return '<label>: <problem>' for each problem of results flagged in had but not in lacks
+
+    had and lacks map labels to audit_shapes results of two audits.
+    """
+    return [f"{result['label']}: {name}" for result in results for flag, name in PLAN_PROBLEMS
+            if had[result['label']][flag] and not lacks[result['label']][flag]]
+
+def product_storage(conn):
+    """Return (table, {filter column: stored column}) for the table holding products
+
+    In the compact layout products is a view over product_rows, which
+    stores category, brand and department as *_id columns; indexes have to
+    go on product_rows.
+    """
+    kind = conn.execute("SELECT type FROM sqlite_master WHERE name = 'products'").fetchone()
+    if kind and kind[0] == 'view':
+        stored = {row[1] for row in conn.execute("PRAGMA table_info(product_rows)")}
+        if stored:
+            return 'product_rows', {column: f'{column}_id' for column in EQUALITY_FILTERS
+                                    if f'{column}_id' in stored}
+    return 'products', {}
+
+def product_indexes(conn):
+    """Return {index name: (columns...)} for the indexes on the table holding products"""
+    table, _ = product_storage(conn)
+    indexes = {}
+    for row in conn.execute(f"PRAGMA index_list({table})").fetchall():
+        name = row[1]
+        indexes[name] = tuple(info[2] for info in conn.execute(f"PRAGMA index_info('{name}')"))
+    return indexes
+
+def propose_indexes(conn, results):
+    """Propose an index for every flagged shape whose filter no index leads with
+
+    The proposal is the shape's equality columns followed by retail_price
+    when it filters on price, e.g. products(category, retail_price), so one
+    index search serves the whole filter and covers its count. Returns
+    {create statement: [flagged results]}.
+    """
+    table, stored = product_storage(conn)
+    existing = list(product_indexes(conn).values())
+    proposals = {}
+    for result in results:
+        if not flagged(result) or not result['columns']:
+            continue
+        columns = tuple(stored.get(column, column) for column in result['columns'])
+        if any(index[:len(columns)] == columns for index in existing):
+            continue
+        name = f'idx_{table}_' + '_'.join(columns)
+        statement = f"CREATE INDEX IF NOT EXISTS {name} ON {table}({', '.join(columns)})"
+        proposals.setdefault(statement, []).append(result)
+    return proposals
+
+def audit_query_plans(conn, create_indexes=False, copy_path=None):
+    """Check the plans of the API's product queries and propose indexes for the slow ones
+
+    With create_indexes each proposed index is created on its own and every
+    query re-explained; the indexes that fix a flagged plan without making
+    another one worse are kept. They are created in a copy of the database
+    at copy_path, or in the database itself if copy_path is None. Returns
+    the list of proposed CREATE INDEX statements that were not kept or
+    created.
+    """
+    print("\n🧭 Query Plan Audit:")
+    shapes = list(product_query_shapes(conn))
+    results = audit_shapes(conn, shapes)
+    problem_results = [result for result in results if flagged(result)]
+    for result in problem_results:
+        problems = [name for flag, name in PLAN_PROBLEMS if result[flag]]
+        print(f"  ⚠️  {result['label']}: {', '.join(problems)} ({result['seconds'] * 1000:.1f} ms)")
+        for line in result['plan']:
+            print(f"       {line}")
+    print(f"  ✅ {len(results) - len(problem_results)} of {len(results)} query shapes have no avoidable scan, sort or partly indexed filter")
+
+    if any(not result['columns'] for result in problem_results):
+        print("  ℹ️  Text search without the products_fts index reads every product; "
+              "load_data_improved.py builds it")
+
+    proposals = propose_indexes(conn, problem_results)
+    if not proposals:
+        print("  ✅ No new indexes to propose")
+        return []
+    print("\n💡 Proposed indexes:")
+    for statement, helped in proposals.items():
+        print(f"  {statement};  -- flagged shapes: {', '.join(result['label'] for result in helped)}")
+    if not create_indexes:
+        print("  Run 'python verify_setup.py --create-indexes' to try them in a copy of the database, "
+              "and add the ones that help to database_schema.sql")
+        return list(proposals)
+
+    if copy_path is not None:
+        # Leave the database the API serves alone; the indexes go into a copy
+        target = sqlite3.connect(copy_path)
+        conn.backup(target)
+        conn = target
+        print(f"\n📄 Trying the indexes in a copy: {copy_path}")
+
+    # Each index is tried on its own against the plans above: it is kept if
+    # it removes a problem from a flagged shape's plan (a scan that becomes
+    # a search, a temp B-tree that is no longer needed, a filter the index
+    # now serves in full) without adding one to any shape's plan. Timings
+    # are shown but not used to decide, since they vary from run to run.
+    print("\n🧪 Trying each proposed index:")
+    before = {result['label']: result for result in results}
+    kept = []
+    not_kept = []
+    for statement, helped in proposals.items():
+        index_name = statement.split()[5]
+        conn.execute(statement)
+        conn.execute(f"ANALYZE {index_name}")
+        after = {result['label']: result for result in audit_shapes(conn, shapes)}
+        conn.execute(f"DROP INDEX {index_name}")
+
+        fixed = plan_changes(helped, before, after)
+        regressed = plan_changes(after.values(), after, before)
+        summary = f"fixes {len(fixed)} plan problem(s), adds {len(regressed)}"
+        if fixed and not regressed:
+            kept.append(statement)
+            print(f"  ✅ {index_name}: {summary}")
+        else:
+            not_kept.append(statement)
+            print(f"  ❌ {index_name}: {summary}; not kept")
+        for change in fixed:
+            print(f"       fixed {change}")
+        for change in regressed:
+            print(f"       added {change}")
+        for result in helped:
+            print(f"       {result['label']}: {result['seconds'] * 1000:.1f} ms -> "
+                  f"{after[result['label']]['seconds'] * 1000:.1f} ms")
+
+    for statement in kept:
+        conn.execute(statement)
+    conn.execute("ANALYZE")
+    conn.commit()
+    if copy_path is not None:
+        conn.close()
+        if kept:
+            print(f"  The copy has the {len(kept)} kept index(es); add them to database_schema.sql, "
+                  f"or rerun with --in-place to create them in the database itself")
+    return not_kept
+
+def indexed_copy_path(db_path):
+    """Return the path of the copy --create-indexes writes, e.g. ecommerce.indexed.db"""
+    root, extension = os.path.splitext(db_path)
+    return f'{root}.indexed{extension}'
+
+def verify_database_setup(db_path=DATABASE, audit_plans=False, create_indexes=False, in_place=False):
+    """Verify that the database is properly set up and contains all expected data
+
+    With audit_plans the query plans of the API's product queries are
+    checked too (see audit_query_plans); their findings are warnings and do
+    not fail verification. create_indexes tries the proposed indexes in a
+    copy of the database, or in the database itself with in_place.
+    """
     
     print("=== Think41 E-commerce Database Setup Verification ===\n")
     
     # Check if database file exists
-    if not os.path.exists('ecommerce.db'):
-        print("❌ ERROR: Database file 'ecommerce.db' not found!")
+    if not os.path.exists(db_path):
+        print(f"❌ ERROR: Database file '{db_path}' not found!")
         return False
     
-    db_size = os.path.getsize('ecommerce.db') / (1024 * 1024)  # Size in MB
+    db_size = os.path.getsize(db_path) / (1024 * 1024)  # Size in MB
     print(f"✅ Database file exists: {db_size:.1f} MB")
     
     # Connect to database
     try:
-        conn = sqlite3.connect('ecommerce.db')
+        conn = sqlite3.connect(db_path)
         cursor = conn.cursor()
         print("✅ Database connection successful")
     except Exception as e:
         print(f"❌ ERROR: Cannot connect to database: {e}")
         return False
     
+    # Check the file is not damaged
+    cursor.execute("PRAGMA quick_check")
+    result = cursor.fetchone()[0]
+    if result != 'ok':
+        print(f"❌ ERROR: Integrity check failed: {result}")
+        conn.close()
+        return False
+    print("✅ Integrity check passed")
+    
     # Check all tables exist
     expected_tables = ['distribution_centers', 'users', 'products', 'orders', 'inventory_items', 'order_items']
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    # Tables may be views over compact storage (load_data_improved.py --compact)
+    cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")
     existing_tables = [row[0] for row in cursor.fetchall()]
     
     print("\n📊 Table Verification:")
@@ -33,9 +365,14 @@ def verify_database_setup():
         if table in existing_tables:
             cursor.execute(f"SELECT COUNT(*) FROM {table}")
             count = cursor.fetchone()[0]
+            if count == 0:
+                print(f"  ❌ {table}: no records")
+                conn.close()
+                return False
             print(f"  ✅ {table}: {count:,} records")
         else:
             print(f"  ❌ {table}: NOT FOUND")
+            conn.close()
             return False
     
     # Verify data integrity with sample queries
@@ -56,6 +393,19 @@ def verify_database_setup():
     valid_orders = cursor.fetchone()[0]
     print(f"  ✅ Orders with valid status: {valid_orders:,}")
     
+    # Check the loader's summary tables agree with products
+    if 'product_stats_summary' in existing_tables:
+        cursor.execute("SELECT total_products FROM product_stats_summary WHERE id = 1")
+        summary = cursor.fetchone()
+        cursor.execute("SELECT COUNT(*) FROM products WHERE retail_price IS NOT NULL")
+        priced_products = cursor.fetchone()[0]
+        if summary is None or summary[0] != priced_products:
+            print(f"  ❌ Product summary is stale: {summary[0] if summary else 'empty'} "
+                  f"products summarized, {priced_products:,} in products")
+            conn.close()
+            return False
+        print(f"  ✅ Product summary tables match products: {priced_products:,}")
+    
     # Check foreign key relationships
     print("\n🔗 Relationship Checks:")
     
@@ -96,16 +446,34 @@ def verify_database_setup():
     if order:
         print(f"  ✅ Sample order: ID {order[0]}, User: {order[1]}, Status: {order[2]}")
     
+    if audit_plans:
+        audit_query_plans(conn, create_indexes, None if in_place else indexed_copy_path(db_path))
+    
     conn.close()
     
     print("\n🎉 VERIFICATION COMPLETE!")
     print("✅ Database setup is successful and ready for use!")
-    print("\n📝 Next steps:")
-    print("  - Run 'python query_database.py' to see sample queries")
-    print("  - Use any SQLite client to explore the data")
-    print("  - Start building your e-commerce analytics!")
     
     return True
 
 if __name__ == "__main__":
-    verify_database_setup() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Verify the e-commerce database')
+    parser.add_argument('--database', default=DATABASE,
+                        help=f'database to verify (default: {DATABASE})')
+    parser.add_argument('--skip-plan-audit', action='store_true',
+                        help="don't check the query plans of the API's product queries")
+    parser.add_argument('--create-indexes', action='store_true',
+                        help='try each index the plan audit proposes and keep the ones that fix a query plan, '
+                             f'in a copy of the database (e.g. {indexed_copy_path(DATABASE)})')
+    parser.add_argument('--in-place', action='store_true',
+                        help='with --create-indexes, create the kept indexes in the database itself')
+    args = parser.parse_args()
+    if args.in_place and not args.create_indexes:
+        parser.error('--in-place requires --create-indexes')
+
+    if verify_database_setup(args.database, audit_plans=not args.skip_plan_audit,
+                             create_indexes=args.create_indexes, in_place=args.in_place):
+        print("\n📝 Next steps:")
+        print("  - Run 'python query_database.py' to see sample queries")
+        print("  - Use any SQLite client to explore the data")
+        print("  - Start building your e-commerce analytics!") 
\ No newline at end of file